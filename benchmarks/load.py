@@ -0,0 +1,561 @@
+"""Synthetic load benchmarks for the platoon task queue.
+
+Runs the platoon api and the task queue daemon against a local postgres
+database and a local stand-in http server, drives one or more scenarios
+through the api, and reports throughput, dispatch lag percentiles and
+database activity for each.
+
+The benchmark database must exist and be migrated beforehand; every table
+platoon owns is truncated before each scenario, so never point this at a
+database holding real data. Typical usage, from the repository root:
+
+    python -m benchmarks.load --database postgresql://postgres@localhost/platoon_benchmark
+    python -m benchmarks.load --scenario oneshot --tasks 100000 --latency 0.02 --json oneshot.json
+
+Scenarios:
+
+    oneshot    one-shot scheduled tasks which all fall due together
+    recurring  recurring tasks on a shared fixed schedule, run for a duration
+    fanout     events fanned out to many subscribed tasks at a steady rate
+    process    process lifecycles through a queue and an executor
+"""
+
+import json
+import math
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from optparse import OptionParser
+from string import Template
+from urlparse import urlparse, urlunparse
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+
+from platoon.constants import HISTOGRAM_BUCKETS
+from platoon.support.http import http_request
+from benchmarks.standin import StandinServer
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PLATOON_TABLES = ('task', 'action', 'schedule', 'event', 'process', 'queue', 'executor',
+    'endpoint', 'task_histogram', 'worker')
+SCENARIOS = ('oneshot', 'recurring', 'fanout', 'process')
+
+def format_timestamp(timestamp):
+    return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def percentile(values, fraction):
+    if not values:
+        return None
+
+    values = sorted(values)
+    index = int(math.ceil(fraction * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+def wait_for_port(host, port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.25)
+    raise RuntimeError('nothing is listening on %s:%d' % (host, port))
+
+def allocate_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+class DatabaseCounters(object):
+    """Snapshots of postgres activity counters for the benchmark database."""
+
+    STATEMENT = ("select xact_commit, xact_rollback, tup_returned, tup_fetched,"
+        " tup_inserted, tup_updated, tup_deleted from pg_stat_database"
+        " where datname = current_database()")
+    FIELDS = ('commits', 'rollbacks', 'returned', 'fetched', 'inserted', 'updated', 'deleted')
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = self._has_statement_statistics()
+
+    def difference(self, before, after):
+        return dict((key, after[key] - before[key]) for key in after
+            if after.get(key) is not None and before.get(key) is not None)
+
+    def snapshot(self):
+        connection = self.engine.connect()
+        try:
+            connection.execute(text('select pg_stat_clear_snapshot()'))
+            row = connection.execute(text(self.STATEMENT)).fetchone()
+            values = dict(zip(self.FIELDS, row))
+
+            values['statements'] = None
+            if self.statements:
+                values['statements'] = connection.execute(text("select sum(calls)"
+                    " from pg_stat_statements s join pg_database d on d.oid = s.dbid"
+                    " where d.datname = current_database()")).scalar()
+            return values
+        finally:
+            connection.close()
+
+    def _has_statement_statistics(self):
+        connection = self.engine.connect()
+        try:
+            return bool(connection.execute(text("select count(*) from pg_extension"
+                " where extname = 'pg_stat_statements'")).scalar())
+        finally:
+            connection.close()
+
+class Environment(object):
+    """The api server, task queue daemon and stand-in used by a benchmark run."""
+
+    def __init__(self, options):
+        self.api_port = options.api_port or allocate_port()
+        self.directory = None
+        self.engine = create_engine(options.database)
+        self.counters = DatabaseCounters(self.engine)
+        self.daemon = None
+        self.metrics_port = options.metrics_port or allocate_port()
+        self.options = options
+        self.server = None
+        self.standin = None
+
+    @property
+    def api_url(self):
+        return 'http://127.0.0.1:%d/platoon/1.0' % self.api_port
+
+    def request(self, method, resource, data=None, subject=None):
+        url = '%s/%s' % (self.api_url, resource)
+        if subject:
+            url = '%s/%s' % (url, subject)
+
+        response = http_request(method, url, data, 'application/json', timeout=60,
+            serialize=True)
+        if not response.ok:
+            raise response.exception
+        return response.unserialize()
+
+    def reset(self):
+        connection = self.engine.connect()
+        try:
+            connection.execute(text('truncate %s cascade' % ', '.join(PLATOON_TABLES))
+                .execution_options(autocommit=True))
+        finally:
+            connection.close()
+        self.request_standin('DELETE', '/_stats')
+
+    def request_standin(self, method, path):
+        response = http_request(method, self.standin.url + path, timeout=60)
+        return response.unserialize()
+
+    def query_histogram(self, tag, metric='lag'):
+        connection = self.engine.connect()
+        try:
+            rows = connection.execute(text("select bucket, sum(count) from task_histogram"
+                " where tag = :tag and metric = :metric group by bucket"),
+                {'tag': tag, 'metric': metric}).fetchall()
+        finally:
+            connection.close()
+
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for bucket, count in rows:
+            counts[bucket] += count
+        return counts
+
+    def scrape_metrics(self):
+        response = http_request('GET', 'http://127.0.0.1:%d/metrics' % self.metrics_port,
+            timeout=10)
+
+        metrics = {}
+        for line in (response.content or '').splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                metrics[name] = float(value)
+        return metrics
+
+    def start(self):
+        options = self.options
+        self.directory = tempfile.mkdtemp(prefix='platoon-benchmark-')
+        self.standin = StandinServer(latency=options.latency, jitter=options.jitter,
+            error_rate=options.error_rate).start()
+
+        database = urlparse(options.database)
+        parameters = {
+            'admin_url': urlunparse(database[:2] + ('/postgres',) + database[3:]),
+            'api_port': self.api_port,
+            'api_processes': options.api_processes,
+            'capacity': options.capacity,
+            'claim_mode': options.claim_mode,
+            'database_url': options.database,
+            'engine': options.engine,
+            'fifo': os.path.join(self.directory, 'idler'),
+            'metrics_port': self.metrics_port,
+        }
+
+        for name in ('api.yaml', 'queue.yaml'):
+            with open(os.path.join(BENCHMARK_DIRECTORY, name)) as source:
+                content = Template(source.read()).substitute(parameters)
+            with open(os.path.join(self.directory, name), 'w') as target:
+                target.write(content)
+
+        self.server = subprocess.Popen([options.uwsgi, '--yaml',
+            os.path.join(self.directory, 'api.yaml')])
+        wait_for_port('127.0.0.1', self.api_port)
+
+    def start_daemon(self):
+        self.daemon = subprocess.Popen([self.options.bake, '-m', 'spire.tasks', 'spire.daemon',
+            'config=%s' % os.path.join(self.directory, 'queue.yaml')])
+        wait_for_port('127.0.0.1', self.metrics_port)
+
+    def stop(self):
+        self.stop_daemon()
+        if self.server:
+            self.server.send_signal(signal.SIGINT)
+            self.server.wait()
+        if self.standin:
+            self.standin.stop()
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stop_daemon(self):
+        if self.daemon:
+            self.daemon.send_signal(signal.SIGTERM)
+            self.daemon.wait()
+            self.daemon = None
+
+class Scenario(object):
+    """A benchmark scenario."""
+
+    name = None
+    source = None
+    tag = None
+
+    def __init__(self, environment, options):
+        self.environment = environment
+        self.options = options
+
+    def calculate_expected(self):
+        return None
+
+    def is_complete(self, statistics):
+        expected = self.calculate_expected()
+        if expected is None:
+            return False
+
+        entry = statistics.get(self.source or self.name)
+        return bool(entry) and entry['requests'] - entry['errors'] >= expected
+
+    def drive(self):
+        pass
+
+    def run(self):
+        environment, options = self.environment, self.options
+        environment.reset()
+
+        started = time.time()
+        self.seed()
+        seeded = time.time()
+
+        before = environment.counters.snapshot()
+        environment.start_daemon()
+        try:
+            started_daemon = time.time()
+            driver = threading.Thread(target=self.drive)
+            driver.daemon = True
+            driver.start()
+
+            deadline = started_daemon + options.timeout
+            while True:
+                statistics = environment.request_standin('GET', '/_stats')
+                if self.is_complete(statistics) or time.time() > deadline:
+                    break
+                time.sleep(0.5)
+
+            finished = time.time()
+            metrics = environment.scrape_metrics()
+        finally:
+            environment.stop_daemon()
+
+        statistics = environment.request_standin('GET', '/_stats?lags=1')
+
+        after = environment.counters.snapshot()
+        return self.summarize(statistics, metrics, environment.counters.difference(before, after),
+            seeded - started, finished - started_daemon)
+
+    def seed(self):
+        pass
+
+    def summarize(self, statistics, metrics, database, seeding, elapsed):
+        entry = statistics.get(self.name) or {'requests': 0, 'errors': 0, 'lags': []}
+        lags = entry['lags']
+
+        result = {
+            'scenario': self.name,
+            'requests': entry['requests'],
+            'errors': entry['errors'],
+            'seeding': round(seeding, 3),
+            'elapsed': round(elapsed, 3),
+            'throughput': round(entry['requests'] / elapsed, 2) if elapsed else None,
+            'database': database,
+        }
+
+        if lags:
+            result['lag'] = {'source': 'stand-in', 'p50': percentile(lags, 0.5),
+                'p90': percentile(lags, 0.9), 'p99': percentile(lags, 0.99),
+                'max': max(lags)}
+        elif self.tag:
+            counts = self.environment.query_histogram(self.tag)
+            if sum(counts):
+                result['lag'] = {'source': 'histogram', 'p50': self._estimate(counts, 0.5),
+                    'p90': self._estimate(counts, 0.9), 'p99': self._estimate(counts, 0.99)}
+
+        cycles = metrics.get('platoon_tasks_claimed_count')
+        if cycles:
+            result['claimed_per_cycle'] = round(metrics['platoon_tasks_claimed_sum'] / cycles, 2)
+            result['claim_cycles'] = int(cycles)
+        return result
+
+    def _estimate(self, counts, fraction):
+        threshold, cumulative = fraction * sum(counts), 0
+        for bound, count in zip(HISTOGRAM_BUCKETS + (None,), counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+
+    def _submit_all(self, requests):
+        requests = iter(requests)
+        guard = threading.Lock()
+        failures = []
+
+        def submit():
+            while True:
+                with guard:
+                    try:
+                        arguments = next(requests)
+                    except StopIteration:
+                        return
+                try:
+                    self.environment.request(*arguments)
+                except Exception, exception:
+                    failures.append(exception)
+
+        threads = [threading.Thread(target=submit) for i in range(self.options.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if failures:
+            raise failures[0]
+
+class OneShotScenario(Scenario):
+    """One-shot scheduled tasks which all fall due at once."""
+
+    name = 'oneshot'
+    tag = 'benchmark-oneshot'
+
+    def calculate_expected(self):
+        return self.options.tasks
+
+    def seed(self):
+        options, url = self.options, self.environment.standin.url
+        due = time.time() + options.lead
+
+        def generate():
+            for i in xrange(options.tasks):
+                occurrence = due + (options.spread * i / options.tasks)
+                yield ('POST', 'scheduledtask', {
+                    'tag': self.tag,
+                    'occurrence': format_timestamp(occurrence),
+                    'retry_timeout': 1,
+                    'task': {'type': 'http-request', 'method': 'GET',
+                        'url': '%s/oneshot/%d?due=%.6f' % (url, i, occurrence)},
+                })
+
+        self._submit_all(generate())
+        if time.time() > due:
+            print >>sys.stderr, 'warning: seeding overran the lead time, lag is overstated'
+
+class RecurringScenario(Scenario):
+    """Recurring tasks sharing a fixed schedule, observed for a fixed duration."""
+
+    name = 'recurring'
+    tag = 'benchmark-recurring'
+
+    def __init__(self, environment, options):
+        super(RecurringScenario, self).__init__(environment, options)
+        self.started = None
+
+    def drive(self):
+        self.started = time.time()
+
+    def is_complete(self, statistics):
+        return self.started and time.time() - self.started >= self.options.duration
+
+    def seed(self):
+        options, url = self.options, self.environment.standin.url
+        schedule = self.environment.request('POST', 'schedule', {
+            'name': 'benchmark-fixed',
+            'schedule': {'type': 'fixed', 'anchor': format_timestamp(time.time()),
+                'interval': options.interval},
+        })
+
+        self._submit_all(('POST', 'recurringtask', {
+            'tag': self.tag,
+            'schedule_id': schedule['id'],
+            'task': {'type': 'http-request', 'method': 'GET',
+                'url': '%s/recurring/%d' % (url, i)},
+        }) for i in xrange(options.recurring))
+
+    def summarize(self, statistics, metrics, database, seeding, elapsed):
+        result = super(RecurringScenario, self).summarize(statistics, metrics, database,
+            seeding, elapsed)
+        options = self.options
+        result['expected'] = options.recurring * int(options.duration / options.interval)
+        return result
+
+class FanoutScenario(Scenario):
+    """Events fanned out to many subscribed tasks at a steady rate."""
+
+    name = 'fanout'
+    tag = 'benchmark-fanout'
+
+    def calculate_expected(self):
+        return self.options.subscriptions * self.options.events
+
+    def drive(self):
+        options = self.options
+        interval = 1.0 / options.event_rate
+        for i in xrange(options.events):
+            started = time.time()
+            self.environment.request('POST', 'event', {'topic': 'benchmark',
+                'aspects': {'sequence': str(i)}})
+            time.sleep(max(interval - (time.time() - started), 0))
+
+    def seed(self):
+        options, url = self.options, self.environment.standin.url
+        self._submit_all(('POST', 'subscribedtask', {
+            'tag': self.tag,
+            'topic': 'benchmark',
+            'retry_timeout': 1,
+            'task': {'type': 'http-request', 'method': 'GET',
+                'url': '%s/fanout/%d' % (url, i)},
+        }) for i in xrange(options.subscriptions))
+
+class ProcessScenario(Scenario):
+    """Process lifecycles through a queue and an executor."""
+
+    name = 'process'
+    source = 'queue'
+
+    def calculate_expected(self):
+        return self.options.processes
+
+    def drive(self):
+        self._submit_all(('POST', 'process', {'queue_id': 'benchmark', 'tag': 'benchmark-%d' % i,
+            'input': {'sequence': i}}) for i in xrange(self.options.processes))
+
+    def seed(self):
+        url = self.environment.standin.url
+        self.environment.request('POST', 'executor', {'id': 'benchmark', 'endpoints': {
+            'benchmark': {'type': 'http', 'url': '%s/executor' % url}}})
+        self.environment.request('POST', 'queue', {'id': 'benchmark', 'subject': 'benchmark',
+            'endpoint': {'type': 'http', 'url': '%s/queue' % url}})
+
+    def summarize(self, statistics, metrics, database, seeding, elapsed):
+        merged = dict(statistics)
+        if 'queue' in statistics:
+            merged[self.name] = statistics['queue']
+
+        result = super(ProcessScenario, self).summarize(merged, metrics, database,
+            seeding, elapsed)
+        result['initiations'] = (statistics.get('executor') or {}).get('requests', 0)
+        return result
+
+SCENARIO_CLASSES = {
+    'fanout': FanoutScenario,
+    'oneshot': OneShotScenario,
+    'process': ProcessScenario,
+    'recurring': RecurringScenario,
+}
+
+def report(results):
+    for result in results:
+        print '%s: %d requests (%d errors) in %.2fs, %.2f/s, seeded in %.2fs' % (
+            result['scenario'], result['requests'], result['errors'], result['elapsed'],
+            result['throughput'] or 0, result['seeding'])
+
+        lag = result.get('lag')
+        if lag:
+            print '  dispatch lag (%s): p50=%s p90=%s p99=%s' % (lag['source'],
+                lag['p50'], lag['p90'], lag['p99'])
+        if 'claimed_per_cycle' in result:
+            print '  claimed per cycle: %.2f over %d cycles' % (result['claimed_per_cycle'],
+                result['claim_cycles'])
+
+        database = result['database']
+        print '  database: %s' % ', '.join('%s=%s' % (key, database[key])
+            for key in sorted(database))
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--database', default='postgresql://postgres@localhost/platoon_benchmark')
+    parser.add_option('--scenario', action='append', choices=SCENARIOS,
+        help='scenario to run, may be repeated (default: all)')
+    parser.add_option('--tasks', type='int', default=100000)
+    parser.add_option('--spread', type='float', default=0.0,
+        help='seconds over which one-shot tasks fall due')
+    parser.add_option('--lead', type='float', default=120.0,
+        help='seconds between the start of seeding and the first due time')
+    parser.add_option('--recurring', type='int', default=10000)
+    parser.add_option('--interval', type='int', default=60)
+    parser.add_option('--duration', type='float', default=300.0)
+    parser.add_option('--subscriptions', type='int', default=1000)
+    parser.add_option('--events', type='int', default=100)
+    parser.add_option('--event-rate', type='float', default=10.0)
+    parser.add_option('--processes', type='int', default=1000)
+    parser.add_option('--latency', type='float', default=0.01)
+    parser.add_option('--jitter', type='float', default=0.0)
+    parser.add_option('--error-rate', type='float', default=0.0)
+    parser.add_option('--capacity', type='int', default=20)
+    parser.add_option('--engine', choices=('threaded', 'evented'), default='threaded')
+    parser.add_option('--claim-mode', choices=('lock', 'skip-locked'), default='lock')
+    parser.add_option('--clients', type='int', default=16,
+        help='concurrent api clients used for seeding')
+    parser.add_option('--timeout', type='float', default=1800.0)
+    parser.add_option('--api-port', type='int')
+    parser.add_option('--api-processes', type='int', default=4)
+    parser.add_option('--metrics-port', type='int')
+    parser.add_option('--bake', default='bake')
+    parser.add_option('--uwsgi', default='uwsgi')
+    parser.add_option('--json', help='write results to this file')
+
+    options, arguments = parser.parse_args()
+    environment = Environment(options)
+    environment.start()
+
+    results = []
+    try:
+        for name in (options.scenario or SCENARIOS):
+            results.append(SCENARIO_CLASSES[name](environment, options).run())
+    finally:
+        environment.stop()
+
+    report(results)
+    if options.json:
+        with open(options.json, 'w') as target:
+            json.dump(results, target, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,396 @@
+"""Micro-benchmarks for schedule computation in platoon.support.scheduling.
+
+Each case evaluates one schedule computation from a deterministic sample of
+starting occurrences, checks every result against a brute-force oracle and
+reports the time per call along with the iterations performed per call.
+Iterations are counted by probing the helpers the computation is built from:
+dates and months examined, same-day time scans, weekday step and week computations, and
+interval advances. Typical usage, from the repository root:
+
+    python -m benchmarks.scheduling
+    python -m benchmarks.scheduling --samples 2000 --case logical-fifth-friday-february
+
+The oracles share nothing with the code under test beyond specification
+parsing. The interval oracles step one period at a time from the anchor, as
+the original implementation did, and find dates and weeks by exhaustive
+search; samples include current times many years past the anchor and
+occurrences in non-UTC offsets, so that they double as property checks for
+interval stepping. Schedule cases preview monthly and weekly schedule models
+anchored at each sample, and expect the chain of occurrences the scheduler
+produces when stepping from the anchor. The exit status is non-zero when any
+result disagrees with its oracle.
+"""
+
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, tzinfo
+from datetime import time as clock
+from optparse import OptionParser
+
+from scheme.timezone import UTC
+
+from platoon.support import scheduling
+from platoon.support.scheduling import (Specification, Week, specifications, validate_range,
+    validate_weekday)
+
+ORACLE_HORIZON = 366 * 60
+SCHEDULE_SPAN = timedelta(days=5 * 366)
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+PROBES = (
+    ('dates', Specification, '_check_date'),
+    ('months', Specification, '_matching_days'),
+    ('scans', Specification, '_next_time'),
+    ('steps', scheduling, 'identify_weekday_step'),
+    ('weeks', Week, 'from_date'),
+    ('advances', scheduling, 'advance_by_month'),
+    ('advances', scheduling, 'advance_by_week'),
+)
+
+class Probe(object):
+    """Counts calls to the helpers schedule computations are built from, and pins
+    the current time seen by the scheduling module."""
+
+    def __init__(self, now):
+        self.counts = {}
+        self.now = now
+        self.originals = []
+
+    def __enter__(self):
+        for name, owner, attr in PROBES:
+            original = owner.__dict__[attr]
+            self.originals.append((owner, attr, original))
+            setattr(owner, attr, self._wrap(name, original))
+
+        self.originals.append((scheduling, 'current_timestamp', scheduling.current_timestamp))
+        scheduling.current_timestamp = lambda: self.now
+        return self
+
+    def __exit__(self, *args):
+        while self.originals:
+            owner, attr, original = self.originals.pop()
+            setattr(owner, attr, original)
+
+    def _wrap(self, name, original):
+        counts = lambda: self.counts
+        if isinstance(original, classmethod):
+            function = original.__func__
+            def probe(cls, *args, **params):
+                counts()[name] = counts().get(name, 0) + 1
+                return function(cls, *args, **params)
+            return classmethod(probe)
+
+        def probe(*args, **params):
+            counts()[name] = counts().get(name, 0) + 1
+            return original(*args, **params)
+        return probe
+
+class Oracle(object):
+    """Brute-force evaluation of a schedule specification."""
+
+    def __init__(self, specification):
+        month, day, weekday, hour, minute = specification
+        self.month = set(validate_range('month', month or '*'))
+        self.day = set(validate_range('day', day or '*'))
+        self.weekday = validate_weekday(weekday or '*')
+        self.hour = set(validate_range('hour', hour or '*'))
+        self.minute = set(validate_range('minute', minute or '*'))
+
+    def matches(self, date):
+        if date.month not in self.month or date.day not in self.day:
+            return False
+        if not self.weekday:
+            return True
+
+        steps = self.weekday.get(date.isoweekday())
+        return steps is not None and ((date.day - 1) // 7 + 1) in steps
+
+    def next(self, occurrence):
+        occurrence = occurrence.replace(second=0, microsecond=0)
+        date, start = occurrence.date(), occurrence.hour * 60 + occurrence.minute
+        for offset in xrange(ORACLE_HORIZON):
+            if self.matches(date):
+                for value in xrange(start, 1440):
+                    if value // 60 in self.hour and value % 60 in self.minute:
+                        return datetime.combine(date, clock(value // 60, value % 60)).replace(
+                            tzinfo=occurrence.tzinfo)
+            date, start = date + timedelta(days=1), 0
+        raise RuntimeError('no occurrence within the oracle horizon')
+
+    def occurrences(self, start, end, limit):
+        occurrences, occurrence = [], self.next(start)
+        while occurrence <= end and len(occurrences) < limit:
+            occurrences.append(occurrence)
+            occurrence = self.next(occurrence + timedelta(minutes=1))
+        return occurrences
+
+    def next_monthly_interval(self, interval, occurrence, now):
+        candidate = occurrence.replace(day=1, hour=0, minute=1)
+        threshold = now.replace(day=1, hour=0, minute=0)
+        while candidate < threshold:
+            candidate = oracle_advance_by_month(candidate, interval)
+
+        next = self.next(candidate)
+        if next < now + timedelta(minutes=1):
+            next = self.next(oracle_advance_by_month(candidate, interval))
+        return next
+
+    def next_weekly_interval(self, interval, occurrence, now):
+        if occurrence > now and self.matches(occurrence.date()):
+            if occurrence.hour in self.hour and occurrence.minute in self.minute:
+                return occurrence
+
+        start, end = oracle_week(occurrence.date())
+        candidate = self.next(occurrence + timedelta(minutes=1))
+        if start <= candidate.date() <= end and candidate > now:
+            return candidate
+
+        candidate = datetime.combine(start, clock(0, 0)).replace(tzinfo=occurrence.tzinfo)
+        while now >= candidate:
+            candidate += timedelta(days=7 * interval)
+            start, end = oracle_week(candidate.date())
+            if start <= now.date() <= end:
+                candidate = now
+                break
+
+        return self.next(candidate)
+
+def oracle_advance_by_month(value, interval):
+    months = value.year * 12 + value.month - 1 + interval
+    return value.replace(year=months // 12, month=months % 12 + 1)
+
+def oracle_schedule_occurrences(attrs, interval, anchor, start, end, limit):
+    if attrs['type'] == 'monthly':
+        if attrs['strategy'] == 'day':
+            day, weekday = str(anchor.day), '*'
+        else:
+            day, weekday = '*', '%d/%d' % (anchor.isoweekday(), oracle_weekday_step(anchor))
+        oracle = Oracle(('*', day, weekday, str(anchor.hour), str(anchor.minute)))
+        step = oracle.next_monthly_interval
+    else:
+        anchor = anchor.astimezone(UTC)
+        weekdays = ';'.join(str(i) for i, name in enumerate(WEEKDAYS, 1) if attrs.get(name))
+        oracle = Oracle(('*', '*', weekdays, str(anchor.hour), str(anchor.minute)))
+        step = oracle.next_weekly_interval
+
+    occurrence, occurrences = anchor - timedelta(minutes=1), []
+    while len(occurrences) < limit:
+        occurrence = step(interval, max(occurrence, anchor), occurrence.astimezone(UTC))
+        if occurrence > end:
+            break
+        if occurrence >= start:
+            occurrences.append(occurrence)
+    return occurrences
+
+def oracle_week(date):
+    for offset in xrange(7):
+        start = date - timedelta(days=offset)
+        if start.isoweekday() == 7:
+            return start, start + timedelta(days=6)
+
+def oracle_weekday_step(date):
+    step = 0
+    for day in xrange(1, date.day + 1):
+        if date.replace(day=day).isoweekday() == date.isoweekday():
+            step += 1
+    return step
+
+class Case(object):
+    """A benchmark case."""
+
+    def __init__(self, name, kind, specification, interval=None, window=None, limit=None):
+        self.interval = interval
+        self.limit = limit
+        self.window = window
+        self.kind = kind
+        self.name = name
+        self.specification = specification
+
+    def evaluate(self, occurrence, now):
+        if self.kind == 'weekday-step':
+            return scheduling.identify_weekday_step(occurrence)
+        elif self.kind == 'week':
+            week = Week.from_date(occurrence)
+            return week.start, week.end
+        elif self.kind == 'schedule':
+            start = min(now, occurrence + SCHEDULE_SPAN)
+            return self._construct_schedule(occurrence).occurrences(start,
+                start + self.window, self.limit)
+
+        specification = specifications.acquire(self.name, self.specification)
+        if self.kind == 'next':
+            return specification.next(occurrence)
+        elif self.kind == 'weekly':
+            return specification.next_weekly_interval(self.interval, occurrence)
+        elif self.kind == 'monthly':
+            return specification.next_monthly_interval(self.interval, occurrence)
+        elif self.kind == 'preview':
+            return specification.occurrences(occurrence, occurrence + self.window, self.limit)
+
+    def expect(self, occurrence, now):
+        if self.kind == 'weekday-step':
+            return oracle_weekday_step(occurrence.date())
+        elif self.kind == 'week':
+            return oracle_week(occurrence.date())
+        elif self.kind == 'schedule':
+            start = min(now, occurrence + SCHEDULE_SPAN)
+            return oracle_schedule_occurrences(self.specification, self.interval, occurrence,
+                start, start + self.window, self.limit)
+
+        oracle = Oracle(self.specification)
+        if self.kind == 'next':
+            return oracle.next(occurrence)
+        elif self.kind == 'weekly':
+            return oracle.next_weekly_interval(self.interval, occurrence, now)
+        elif self.kind == 'monthly':
+            return oracle.next_monthly_interval(self.interval, occurrence, now)
+        elif self.kind == 'preview':
+            return oracle.occurrences(occurrence, occurrence + self.window, self.limit)
+
+    def _construct_schedule(self, anchor):
+        from platoon.models.schedule import MonthlySchedule, WeeklySchedule
+
+        attrs = dict(self.specification)
+        if attrs.pop('type') == 'monthly':
+            return MonthlySchedule(anchor=anchor, interval=self.interval, **attrs)
+        else:
+            return WeeklySchedule(anchor=anchor, interval=self.interval, **attrs)
+
+CASES = [
+    Case('logical-every-minute', 'next', ('*', '*', '*', '*', '*')),
+    Case('logical-daily', 'next', ('*', '*', '*', '9', '0')),
+    Case('logical-weekdays', 'next', ('*', '*', '1;2;3;4;5', '9', '30')),
+    Case('logical-quarter-hours', 'next', ('*', '*', '*', '8-17', '*/15')),
+    Case('logical-first-and-fifteenth', 'next', ('*', '1,15', '*', '0', '0')),
+    Case('logical-last-day-31', 'next', ('*', '31', '*', '23', '59')),
+    Case('logical-leap-day', 'next', ('2', '29', '*', '12', '0')),
+    Case('logical-fifth-friday', 'next', ('*', '*', '5/5', '23', '59')),
+    Case('logical-fifth-friday-february', 'next', ('2', '*', '5/5', '23', '59')),
+    Case('logical-fifth-sunday-december-hourly', 'next', ('12', '*', '7/5', '*', '0')),
+    Case('weekly-every-day', 'weekly', ('*', '*', '1;2;3;4;5;6;7', '9', '0'), 1),
+    Case('weekly-mondays-every-third', 'weekly', ('*', '*', '1', '6', '15'), 3),
+    Case('weekly-saturdays-yearly', 'weekly', ('*', '*', '6', '23', '59'), 52),
+    Case('weekly-weekends-fortnightly', 'weekly', ('*', '*', '6;7', '0', '0'), 2),
+    Case('weekly-wednesdays-every-fifth', 'weekly', ('*', '*', '3', '12', '30'), 5),
+    Case('monthly-day', 'monthly', ('*', '15', '*', '10', '0'), 1),
+    Case('monthly-day-31', 'monthly', ('*', '31', '*', '10', '0'), 1),
+    Case('monthly-day-31-quarterly', 'monthly', ('*', '31', '*', '0', '0'), 3),
+    Case('monthly-fifth-friday', 'monthly', ('*', '*', '5/5', '18', '0'), 1),
+    Case('monthly-second-tuesday-yearly', 'monthly', ('*', '*', '2/2', '18', '0'), 12),
+    Case('preview-daily-year', 'preview', ('*', '*', '*', '9', '0'), None,
+        timedelta(days=365), 1000),
+    Case('preview-weekdays-quarter-hours-week', 'preview', ('*', '*', '1;2;3;4;5', '8-17', '*/15'),
+        None, timedelta(days=7), 1000),
+    Case('preview-fifth-friday-decade', 'preview', ('*', '*', '5/5', '23', '59'), None,
+        timedelta(days=3653), 1000),
+    Case('schedule-monthly-day-quarterly', 'schedule', {'type': 'monthly', 'strategy': 'day'},
+        3, timedelta(days=3 * 366), 12),
+    Case('schedule-monthly-weekday-every-fifth', 'schedule',
+        {'type': 'monthly', 'strategy': 'weekday'}, 5, timedelta(days=5 * 366), 12),
+    Case('schedule-weekly-mondays-thursdays-every-third', 'schedule',
+        {'type': 'weekly', 'monday': True, 'thursday': True}, 3, timedelta(days=366), 24),
+    Case('schedule-weekly-sundays-fortnightly', 'schedule',
+        {'type': 'weekly', 'sunday': True}, 2, timedelta(days=366), 24),
+    Case('weekday-step', 'weekday-step', None),
+    Case('week-from-date', 'week', None),
+]
+
+class Offset(tzinfo):
+    """A fixed offset from UTC."""
+
+    def __init__(self, minutes):
+        self.offset = timedelta(minutes=minutes)
+
+    def dst(self, value):
+        return timedelta(0)
+
+    def tzname(self, value):
+        return None
+
+    def utcoffset(self, value):
+        return self.offset
+
+OFFSETS = (UTC, UTC, Offset(-300), Offset(570))
+
+def sample_occurrences(count, seed, start=datetime(2000, 1, 1, tzinfo=UTC), years=40):
+    """Samples starting occurrences across the given span, each paired with a
+    current time ranging from just before it to many years after it, so that
+    interval schedules are exercised both near and far from their anchor."""
+
+    generator = random.Random(seed)
+    span = int(years * 365.25 * 1440)
+    occurrences = []
+    for i in xrange(count):
+        occurrence = start + timedelta(minutes=generator.randrange(span))
+        occurrence = occurrence.astimezone(generator.choice(OFFSETS))
+
+        offset = generator.choice((-2, 0, 1, 30, 1440, 40000, None))
+        if offset is None:
+            offset = generator.randrange(span // 2)
+
+        now = (occurrence + timedelta(minutes=offset)).astimezone(UTC)
+        occurrences.append((occurrence, now))
+    return occurrences
+
+def run_case(case, occurrences):
+    durations, iterations, mismatches = [], {}, []
+    for occurrence, now in occurrences:
+        expected = case.expect(occurrence, now)
+        with Probe(now) as probe:
+            started = time.time()
+            result = case.evaluate(occurrence, now)
+            durations.append(time.time() - started)
+
+        for name, count in probe.counts.iteritems():
+            iterations.setdefault(name, []).append(count)
+        if result != expected:
+            mismatches.append({'occurrence': occurrence.isoformat(), 'now': now.isoformat(),
+                'result': str(result), 'expected': str(expected)})
+
+    calls = len(occurrences)
+    return {
+        'case': case.name,
+        'calls': calls,
+        'mean_us': round(sum(durations) / calls * 1e6, 1),
+        'max_us': round(max(durations) * 1e6, 1),
+        'iterations': dict((name, {'mean': round(float(sum(counts)) / calls, 1),
+            'max': max(counts)}) for name, counts in iterations.iteritems()),
+        'mismatches': mismatches,
+    }
+
+def report(results):
+    print '%-40s %8s %10s %10s  %s' % ('case', 'calls', 'mean us', 'max us', 'iterations (mean/max)')
+    for result in results:
+        iterations = ' '.join('%s=%s/%s' % (name, value['mean'], value['max'])
+            for name, value in sorted(result['iterations'].iteritems()))
+        print '%-40s %8d %10.1f %10.1f  %s' % (result['case'], result['calls'],
+            result['mean_us'], result['max_us'], iterations)
+        for mismatch in result['mismatches'][:5]:
+            print '    mismatch: %(occurrence)s (now %(now)s): %(result)s != %(expected)s' % mismatch
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--samples', type='int', default=500)
+    parser.add_option('--seed', type='int', default=1)
+    parser.add_option('--case', action='append', help='case to run, may be repeated')
+    parser.add_option('--json', help='write results to this file')
+
+    options, arguments = parser.parse_args()
+    occurrences = sample_occurrences(options.samples, options.seed)
+
+    results = []
+    for case in CASES:
+        if not options.case or case.name in options.case:
+            results.append(run_case(case, occurrences))
+
+    report(results)
+    if options.json:
+        with open(options.json, 'w') as target:
+            json.dump(results, target, indent=2, sort_keys=True)
+
+    if any(result['mismatches'] for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""A local stand-in for the http services platoon talks to during benchmarks.
+
+The stand-in accepts any request, waits for a configurable latency and then
+answers with a configurable error rate. Requests carrying a ``due`` query
+parameter (a unix timestamp) are recorded with their arrival lag, and
+process initiations receive a completed initiation response so process
+lifecycles run end to end. Statistics are available at ``/_stats`` and are
+reset with ``DELETE /_stats``; arrival lags are only included when
+``/_stats?lags=1`` is requested.
+"""
+
+import json
+import random
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from optparse import OptionParser
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+
+class Statistics(object):
+    """Request counts and arrival lags, partitioned by the first path segment."""
+
+    def __init__(self):
+        self.guard = threading.Lock()
+        self.reset()
+
+    def record(self, scenario, status, lag=None):
+        with self.guard:
+            entry = self.scenarios.get(scenario)
+            if not entry:
+                entry = self.scenarios[scenario] = {'requests': 0, 'errors': 0,
+                    'first': None, 'last': None, 'lags': []}
+
+            now = time.time()
+            entry['requests'] += 1
+            if status >= 500:
+                entry['errors'] += 1
+            if entry['first'] is None:
+                entry['first'] = now
+            entry['last'] = now
+            if lag is not None:
+                entry['lags'].append(lag)
+
+    def reset(self):
+        with self.guard:
+            self.scenarios = {}
+
+    def summarize(self, lags=False):
+        with self.guard:
+            return dict((scenario, dict(entry, lags=(list(entry['lags']) if lags else [])))
+                for scenario, entry in self.scenarios.iteritems())
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_DELETE(self):
+        if self.path.startswith('/_stats'):
+            self.server.statistics.reset()
+            return self._respond(200, {})
+        self._handle()
+
+    def do_GET(self):
+        if self.path.startswith('/_stats'):
+            lags = 'lags=1' in urlparse(self.path).query
+            return self._respond(200, self.server.statistics.summarize(lags))
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        arrived = time.time()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = (self.rfile.read(length) if length else None)
+
+        url = urlparse(self.path)
+        scenario = url.path.strip('/').split('/', 1)[0] or 'default'
+        parameters = parse_qs(url.query)
+
+        lag = None
+        if 'due' in parameters:
+            lag = max(arrived - float(parameters['due'][0]), 0)
+
+        server = self.server
+        if server.latency:
+            time.sleep(max(random.gauss(server.latency, server.jitter), 0))
+
+        status, content = 200, {}
+        if server.error_rate and random.random() < server.error_rate:
+            status, content = 503, {'error': 'synthetic failure'}
+        elif scenario == 'executor' and body:
+            payload = json.loads(body)
+            if payload.get('status') == 'initiating':
+                content = {'status': 'completed', 'output': {'benchmark': True}}
+
+        server.statistics.record(scenario, status, lag)
+        self._respond(status, content)
+
+    def _respond(self, status, content):
+        content = json.dumps(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    """A threaded stand-in http server."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+        HTTPServer.__init__(self, (address, port), StandinHandler)
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.latency = latency
+        self.statistics = Statistics()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='standin')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--address', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=9797)
+    parser.add_option('--latency', type='float', default=0.0,
+        help='mean response latency in seconds')
+    parser.add_option('--jitter', type='float', default=0.0,
+        help='standard deviation of the response latency in seconds')
+    parser.add_option('--error-rate', type='float', default=0.0,
+        help='fraction of requests answered with a 503')
+
+    options, arguments = parser.parse_args()
+    server = StandinServer(options.address, options.port, options.latency,
+        options.jitter, options.error_rate)
+
+    print 'stand-in listening on %s' % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
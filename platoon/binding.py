@@ -4,7 +4,7 @@ class TaskSupport(object):
     @staticmethod
     def prepare_http_task(task):
         task['type'] = 'http-request'
-        for key in ('mimetype', 'data', 'headers', 'timeout'):
+        for key in ('mimetype', 'data', 'headers', 'timeout', 'capture'):
             if key in task and not task[key]:
                 del task[key]
         return task
@@ -11,4 +11,5 @@ API = Bundle('platoon',
     mount(resources.RecurringTask, 'platoon.controllers.recurringtask.RecurringTaskController'),
     mount(resources.ScheduledTask, 'platoon.controllers.scheduledtask.ScheduledTaskController'),
     mount(resources.SubscribedTask, 'platoon.controllers.subscribedtask.SubscribedTaskController'),
+    mount(resources.TaskHistogram, 'platoon.controllers.taskhistogram.TaskHistogramController'),
 )
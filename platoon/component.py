@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from scheme import Integer, UTC
+from scheme import Enumeration, Integer, UTC
 from spire.core import Component, Configuration
 from spire.mesh import MeshServer
 from spire.schema import Schema
@@ -18,6 +18,10 @@ class Platoon(Component):
     configuration = Configuration({
         'completed_event_lifetime': Integer(nonnull=True, default=30),
         'completed_task_lifetime': Integer(nonnull=True, default=30),
+        'histogram_lifetime': Integer(nonnull=True, default=30),
+        'response_limit': Integer(nonnull=True, minimum=0, default=1048576),
+        'response_overflow': Enumeration('truncate digest', nonnull=True, default='truncate'),
+        'worker_lifetime': Integer(nonnull=True, default=7),
     })
 
     api = APIServer.deploy(bundles=[API], path='/')
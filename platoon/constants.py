@@ -4,6 +4,27 @@ RETRY = 'retry'
 
 PARTIAL = 206
 
+CLAIM_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+CLAIM_WINDOW = 4
+
+EVENT_BATCH_LIMIT = 10
+EVENT_BATCH_SIZE = 100
+
+HISTOGRAM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+IDLE_EXPIRY = 300
+
 PROCESS_TASK_ACTIONS = ('initiate-process',
     'report-abortion', 'report-end', 'report-progress',
     'report-timeout-to-executor', 'report-timeout-to-queue')
+
+DEFAULT_PRIORITY = 0
+SUBSCRIPTION_CHANNEL = 'platoon_subscriptions'
+PROCESS_TASK_PRIORITIES = {
+    'initiate-process': -10,
+    'report-abortion': -10,
+    'report-end': -10,
+    'report-progress': -5,
+    'report-timeout-to-executor': -10,
+    'report-timeout-to-queue': -10,
+}
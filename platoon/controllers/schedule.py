@@ -23,6 +23,13 @@ class ScheduleController(ModelController):
         session.commit()
         return subject
 
+    def occurrences(self, request, response, subject, data):
+        data = data or {}
+        occurrences = subject.occurrences(data.get('start'), data.get('end'),
+            data.get('limit') or 100)
+
+        response({'id': subject.id, 'occurrences': occurrences})
+
     @support_returning
     def update(self, request, response, subject, data):
         if not data:
@@ -41,6 +48,4 @@ class ScheduleController(ModelController):
         resource['schedule'] = model.extract_dict(exclude='id name cached_next schedule_id',
             drop_none=True)
         resource['description'] = model.describe()
-        session = self.schema.session
-        resource['next'] = model.next(session)
-        session.commit()
+        resource['next'] = model.peek_next()
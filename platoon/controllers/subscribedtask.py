@@ -13,7 +13,19 @@ class SubscribedTaskController(TaskController, ModelController):
 
     model = SubscribedTask
     mapping = ('id tag description topic aspects activation_limit retry_backoff'
-        ' retry_limit retry_timeout created activated timeout')
+        ' retry_limit retry_timeout priority created activated timeout')
 
     idler = Dependency(Idler)
     schema = SchemaDependency('platoon')
+
+    def delete(self, request, response, subject, data):
+        session = self.schema.session
+        SubscribedTask.announce(session, subject.id)
+
+        session.delete(subject)
+        session.commit()
+        response({'id': subject.id})
+
+    def _announce_change(self, session, subject):
+        session.flush()
+        SubscribedTask.announce(session, subject.id)
@@ -7,6 +7,7 @@ class TaskController(object):
         session = self.schema.session
 
         subject = self.model.create(session, **data)
+        self._announce_change(session, subject)
         session.commit()
 
         self.idler.interrupt()
@@ -20,11 +21,15 @@ class TaskController(object):
         session = self.schema.session
 
         subject.update(session, **data)
+        self._announce_change(session, subject)
         session.commit()
 
         self.idler.interrupt()
         response({'id': subject.id})
 
+    def _announce_change(self, session, subject):
+        pass
+
     def _annotate_resource(self, request, model, resource, data):
         for field, attr in self.struct_mapping:
             value = getattr(model, attr)
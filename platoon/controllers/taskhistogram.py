@@ -0,0 +1,27 @@
+from mesh.standard import Controller
+from spire.schema import SchemaDependency
+
+from platoon import resources
+from platoon.models import *
+
+class TaskHistogramController(Controller):
+    resource = resources.TaskHistogram
+    version = (1, 0)
+
+    schema = SchemaDependency('platoon')
+
+    def query(self, request, response, subject, data):
+        data = data or {}
+        filters = data.get('query') or {}
+
+        histograms = TaskHistogram.aggregate(self.schema.session, filters.get('tag'),
+            filters.get('metric'), data.get('since'), data.get('until'))
+
+        offset, limit = data.get('offset') or 0, data.get('limit')
+        total = len(histograms)
+        if limit is not None:
+            histograms = histograms[offset:offset + limit]
+        elif offset:
+            histograms = histograms[offset:]
+
+        response({'total': total, 'resources': histograms})
@@ -23,7 +23,9 @@ except ImportError:
         timeout = configured_property('timeout')
 
         def idle(self, timeout=None):
-            time.sleep(timeout or self.timeout)
+            if timeout is None:
+                timeout = self.timeout
+            time.sleep(timeout)
 
         def interrupt(self):
             pass
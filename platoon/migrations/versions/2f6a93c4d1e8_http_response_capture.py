@@ -0,0 +1,20 @@
+"""http_response_capture
+
+Revision: 2f6a93c4d1e8
+Revises: 4b1f0c9e2d7a
+Created: 2026-10-18 10:41:07.553920
+"""
+
+revision = '2f6a93c4d1e8'
+down_revision = '4b1f0c9e2d7a'
+
+from alembic import op
+from spire.schema.fields import *
+from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, PrimaryKeyConstraint, CheckConstraint
+from sqlalchemy.dialects import postgresql
+
+def upgrade():
+    op.add_column('http_request_action', Column('capture', EnumerationType(), nullable=True))
+
+def downgrade():
+    op.drop_column('http_request_action', 'capture')
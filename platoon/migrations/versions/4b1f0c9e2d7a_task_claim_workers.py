@@ -0,0 +1,35 @@
+"""task_claim_workers
+
+Revision: 4b1f0c9e2d7a
+Revises: 537d82e49065
+Created: 2026-10-18 09:12:44.318204
+"""
+
+revision = '4b1f0c9e2d7a'
+down_revision = '537d82e49065'
+
+from alembic import op
+from spire.schema.fields import *
+from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, PrimaryKeyConstraint, CheckConstraint
+from sqlalchemy.dialects import postgresql
+
+def upgrade():
+    op.create_table('worker',
+        Column('id', TokenType(), nullable=False),
+        Column('hostname', TextType(), nullable=True),
+        Column('pid', IntegerType(), nullable=True),
+        Column('started', DateTimeType(timezone=True), nullable=True),
+        Column('heartbeat', DateTimeType(timezone=True), nullable=True),
+        PrimaryKeyConstraint('id')
+    )
+    op.add_column('scheduled_task', Column('worker_id', TokenType(), nullable=True))
+    op.add_column('scheduled_task', Column('claimed', DateTimeType(timezone=True), nullable=True))
+    op.create_foreign_key(
+        'scheduled_task_worker_id_fkey', 'scheduled_task', 'worker',
+        ['worker_id'], ['id'], ondelete='SET NULL')
+
+def downgrade():
+    op.drop_constraint('scheduled_task_worker_id_fkey', 'scheduled_task', 'foreignkey')
+    op.drop_column('scheduled_task', 'claimed')
+    op.drop_column('scheduled_task', 'worker_id')
+    op.drop_table('worker')
@@ -0,0 +1,34 @@
+"""task_priority
+
+Revision: 5d2e8a71c3b9
+Revises: 2f6a93c4d1e8
+Created: 2026-10-18 13:05:27.604118
+"""
+
+revision = '5d2e8a71c3b9'
+down_revision = '2f6a93c4d1e8'
+
+from alembic import op
+from spire.schema.fields import *
+from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, PrimaryKeyConstraint, CheckConstraint
+from sqlalchemy.dialects import postgresql
+
+def upgrade():
+    for table in ('scheduled_task', 'recurring_task', 'subscribed_task'):
+        op.add_column(table, Column('priority', IntegerType(), nullable=False,
+            server_default='0'))
+        op.alter_column(table, 'priority', server_default=None)
+
+    op.execute("update scheduled_task set priority = -10 from process_task"
+        " where process_task.task_id = scheduled_task.task_id"
+        " and process_task.phase != 'report-progress'")
+    op.execute("update scheduled_task set priority = -5 from process_task"
+        " where process_task.task_id = scheduled_task.task_id"
+        " and process_task.phase = 'report-progress'")
+    op.execute("create index scheduled_task_dispatch_idx on scheduled_task (priority, occurrence)"
+        " where status in ('pending', 'retrying')")
+
+def downgrade():
+    op.execute("drop index scheduled_task_dispatch_idx")
+    for table in ('scheduled_task', 'recurring_task', 'subscribed_task'):
+        op.drop_column(table, 'priority')
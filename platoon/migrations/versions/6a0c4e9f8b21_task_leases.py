@@ -0,0 +1,23 @@
+"""task_leases
+
+Revision: 6a0c4e9f8b21
+Revises: 5d2e8a71c3b9
+Created: 2026-10-18 14:21:09.338512
+"""
+
+revision = '6a0c4e9f8b21'
+down_revision = '5d2e8a71c3b9'
+
+from alembic import op
+from spire.schema.fields import *
+from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, PrimaryKeyConstraint, CheckConstraint
+from sqlalchemy.dialects import postgresql
+
+def upgrade():
+    op.add_column('scheduled_task', Column('lease', DateTimeType(timezone=True), nullable=True))
+    op.execute("create index scheduled_task_lease_idx on scheduled_task (lease)"
+        " where status = 'executing'")
+
+def downgrade():
+    op.execute("drop index scheduled_task_lease_idx")
+    op.drop_column('scheduled_task', 'lease')
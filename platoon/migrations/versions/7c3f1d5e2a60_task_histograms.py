@@ -0,0 +1,32 @@
+"""task_histograms
+
+Revision: 7c3f1d5e2a60
+Revises: 6a0c4e9f8b21
+Created: 2026-10-18 15:47:52.180337
+"""
+
+revision = '7c3f1d5e2a60'
+down_revision = '6a0c4e9f8b21'
+
+from alembic import op
+from spire.schema.fields import *
+from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, PrimaryKeyConstraint, CheckConstraint
+from sqlalchemy.dialects import postgresql
+
+def upgrade():
+    op.create_table('task_histogram',
+        Column('tag', TextType(), nullable=False),
+        Column('metric', EnumerationType(), nullable=False),
+        Column('period', DateTimeType(timezone=True), nullable=False),
+        Column('bucket', IntegerType(), nullable=False),
+        Column('count', IntegerType(), nullable=False),
+        Column('total', FloatType(), nullable=False),
+        PrimaryKeyConstraint('tag', 'metric', 'period', 'bucket')
+    )
+    op.add_column('execution', Column('due', DateTimeType(timezone=True), nullable=True))
+    op.add_column('scheduled_task', Column('due', DateTimeType(timezone=True), nullable=True))
+
+def downgrade():
+    op.drop_column('scheduled_task', 'due')
+    op.drop_column('execution', 'due')
+    op.drop_table('task_histogram')
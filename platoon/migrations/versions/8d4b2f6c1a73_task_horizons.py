@@ -0,0 +1,29 @@
+"""task_horizons
+
+Revision: 8d4b2f6c1a73
+Revises: 7c3f1d5e2a60
+Created: 2026-10-18 18:02:41.507219
+"""
+
+revision = '8d4b2f6c1a73'
+down_revision = '7c3f1d5e2a60'
+
+from alembic import op
+from spire.schema.fields import *
+from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, PrimaryKeyConstraint, CheckConstraint
+from sqlalchemy.dialects import postgresql
+
+def upgrade():
+    op.add_column('recurring_task', Column('horizon', IntegerType(), nullable=True))
+    op.add_column('recurring_task', Column('frontier', DateTimeType(timezone=True), nullable=True))
+    op.add_column('scheduled_task', Column('materialized', BooleanType(), nullable=False,
+        server_default='false'))
+    op.alter_column('scheduled_task', 'materialized', server_default=None)
+    op.execute("create index scheduled_task_parent_idx on scheduled_task (parent_id)"
+        " where status = 'pending'")
+
+def downgrade():
+    op.execute("drop index scheduled_task_parent_idx")
+    op.drop_column('scheduled_task', 'materialized')
+    op.drop_column('recurring_task', 'frontier')
+    op.drop_column('recurring_task', 'horizon')
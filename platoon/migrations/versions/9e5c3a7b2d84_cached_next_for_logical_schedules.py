@@ -0,0 +1,21 @@
+"""cached_next for logical schedules
+
+Revision: 9e5c3a7b2d84
+Revises: 8d4b2f6c1a73
+Created: 2026-10-18 18:40:12.664081
+"""
+
+revision = '9e5c3a7b2d84'
+down_revision = '8d4b2f6c1a73'
+
+from alembic import op
+from spire.schema.fields import *
+from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, PrimaryKeyConstraint, CheckConstraint
+from sqlalchemy.dialects import postgresql
+
+def upgrade():
+    op.add_column('logical_schedule',
+        Column('cached_next', DateTimeType(timezone=True), nullable=True))
+
+def downgrade():
+    op.drop_column('logical_schedule', 'cached_next')
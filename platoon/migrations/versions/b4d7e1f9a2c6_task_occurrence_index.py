@@ -0,0 +1,21 @@
+"""task_occurrence_index
+
+Revision: b4d7e1f9a2c6
+Revises: 9e5c3a7b2d84
+Created: 2026-10-18 20:42:17.503926
+"""
+
+revision = 'b4d7e1f9a2c6'
+down_revision = '9e5c3a7b2d84'
+
+from alembic import op
+from spire.schema.fields import *
+from sqlalchemy import Column, ForeignKey, ForeignKeyConstraint, PrimaryKeyConstraint, CheckConstraint
+from sqlalchemy.dialects import postgresql
+
+def upgrade():
+    op.execute("create index scheduled_task_occurrence_idx on scheduled_task (occurrence)"
+        " where status in ('pending', 'retrying')")
+
+def downgrade():
+    op.execute("drop index scheduled_task_occurrence_idx")
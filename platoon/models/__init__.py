@@ -9,3 +9,5 @@ from .schedule import *
 from .scheduledtask import *
 from .subscribedtask import *
 from .task import *
+from .taskhistogram import *
+from .worker import *
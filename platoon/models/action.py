@@ -1,3 +1,5 @@
+from urlparse import urlparse
+
 from scheme import UTC, current_timestamp
 from scheme import formats
 from spire.core import get_unit
@@ -5,7 +7,7 @@ from spire.schema import *
 from spire.support.logs import LogHelper
 
 from platoon.constants import *
-from platoon.support.http import http_request
+from platoon.support.http import Request
 
 __all__ = ('HttpRequestAction', 'InternalAction', 'TaskAction', 'TestAction',
            'ProcessAction',)
@@ -24,6 +26,16 @@ class TaskAction(Model):
     id = Identifier()
     type = Enumeration('http-request internal process test', nullable=False)
 
+    @property
+    def host(self):
+        return None
+
+    def interpret_response(self, task, session, response):
+        return FAILED, '%s actions do not interpret responses' % self.type
+
+    def prepare_request(self, task, session):
+        return None
+
 class TestAction(TaskAction):
     """A test action."""
 
@@ -62,12 +74,15 @@ class InternalAction(TaskAction):
         return COMPLETED, None
 
     def _purge_database(self, session):
-        from platoon.models import Event, ScheduledTask, SubscribedTask
+        from platoon.models import (Event, ScheduledTask, SubscribedTask, TaskHistogram,
+            Worker)
         platoon = get_unit('platoon.component.Platoon')
 
         Event.purge(session, platoon.configuration['completed_event_lifetime'])
         ScheduledTask.purge(session, platoon.configuration['completed_task_lifetime'])
         SubscribedTask.purge(session, platoon.configuration['completed_task_lifetime'])
+        TaskHistogram.purge(session, platoon.configuration['histogram_lifetime'])
+        Worker.purge(session, platoon.configuration['worker_lifetime'])
 
         session.commit()
 
@@ -85,6 +100,17 @@ class ProcessAction(TaskAction):
 
     process = relationship('Process')
 
+    @property
+    def host(self):
+        report = self.process.prepare_report(self.action)
+        if report:
+            endpoint = report[0]
+        else:
+            endpoint = self.process.endpoint
+
+        if endpoint:
+            return endpoint.host
+
     def execute(self, task, session):
         method = self.action.replace('-', '_')
         response = getattr(self.process, method)(session)
@@ -92,6 +118,16 @@ class ProcessAction(TaskAction):
         response = response or (COMPLETED, None)
         return response
 
+    def interpret_response(self, task, session, response):
+        endpoint, payload = self.process.prepare_report(self.action)
+        return endpoint.interpret_response(response)
+
+    def prepare_request(self, task, session):
+        report = self.process.prepare_report(self.action)
+        if report:
+            endpoint, payload = report
+            return endpoint.prepare_request(payload)
+
 class HttpRequestAction(TaskAction):
     """An http request action."""
 
@@ -108,12 +144,17 @@ class HttpRequestAction(TaskAction):
     headers = Serialized()
     timeout = Integer()
     injections = Serialized()
+    capture = Enumeration('body headers')
+
+    @property
+    def host(self):
+        return urlparse(self.url).hostname
 
     def execute(self, task, session):
-        body = self._prepare_body(task, self.data)
-        response = http_request(self.method, self.url, body,
-            self.mimetype, self.headers, self.timeout)
+        response = self.prepare_request(task, session).send()
+        return self.interpret_response(task, session, response)
 
+    def interpret_response(self, task, session, response):
         if response.status == PARTIAL:
             status = RETRY
         elif 200 <= response.status <= 299:
@@ -126,6 +167,15 @@ class HttpRequestAction(TaskAction):
 
         return status, response.dump()
 
+    def prepare_request(self, task, session):
+        platoon = get_unit('platoon.component.Platoon')
+        body = self._prepare_body(task, self.data)
+
+        return Request(self.method, self.url, body, self.mimetype, self.headers,
+            self.timeout, limit=platoon.configuration['response_limit'],
+            overflow=platoon.configuration['response_overflow'],
+            headers_only=(self.capture == 'headers'))
+
     def _prepare_body(self, task, body):
         if self.mimetype != 'application/json':
             return body
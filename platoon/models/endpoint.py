@@ -1,7 +1,10 @@
+from urlparse import urlparse
+
+from spire.core import get_unit
 from spire.schema import *
 
 from platoon.constants import *
-from platoon.support.http import http_request
+from platoon.support.http import Request
 
 __all__ = ('Endpoint', 'HttpEndpoint')
 
@@ -18,6 +21,10 @@ class Endpoint(Model):
     id = Identifier()
     type = Enumeration('http', nullable=False)
 
+    @property
+    def host(self):
+        return None
+
 class HttpEndpoint(Endpoint):
     """An http endpoint."""
 
@@ -33,14 +40,25 @@ class HttpEndpoint(Endpoint):
     headers = Json()
     info = Json()
 
-    def request(self, data, timeout=None):
-        if self.info:
-            data['info'] = self.info
-
-        response = http_request(self.method, self.url, data, self.mimetype,
-            self.headers, timeout, True)
+    @property
+    def host(self):
+        return urlparse(self.url).hostname
 
+    def interpret_response(self, response):
         if response.ok:
             return COMPLETED, response.unserialize()
         else:
             return FAILED, response.dump()
+
+    def prepare_request(self, data, timeout=None):
+        platoon = get_unit('platoon.component.Platoon')
+        if self.info:
+            data['info'] = self.info
+
+        return Request(self.method, self.url, data, self.mimetype, self.headers,
+            timeout, True, limit=platoon.configuration['response_limit'],
+            overflow=platoon.configuration['response_overflow'])
+
+    def request(self, data, timeout=None):
+        response = self.prepare_request(data, timeout).send()
+        return self.interpret_response(response)
@@ -5,7 +5,9 @@ from spire.schema import *
 from spire.support.logs import LogHelper
 from sqlalchemy.sql import bindparam, text
 
-from platoon.models.subscribedtask import SubscribedTask
+from platoon.constants import *
+from platoon.models.scheduledtask import ScheduledTask
+from platoon.support.metrics import registry as metrics
 
 __all__ = ('Event',)
 
@@ -25,8 +27,39 @@ class Event(Model):
     status = Enumeration('pending completed', nullable=False, default='pending')
     occurrence = DateTime(timezone=True)
 
-    HSTORE_FILTER = text(':aspects @> subscribed_task.aspects',
-        bindparams=[bindparam('aspects', type_=aspects.type)])
+    FANOUT_STATEMENT = (
+        "with events (topic, aspects, parameters, ordinal) as (values %s), %s,"
+        " matched as (select task_id, priority, parameters,"
+        "  md5(random()::text || clock_timestamp()::text || task_id::text)::uuid as id"
+        "  from candidates"
+        "  where activation_limit is null or rank <= activation_limit - activations),"
+        " activated as (update subscribed_task s set activations = s.activations + m.count,"
+        "  activated = :now from (select task_id, count(*) as count from matched"
+        "  group by task_id) m where s.task_id = m.task_id),"
+        " spawned as (insert into task (id, type, tag, description, retry_backoff,"
+        "  retry_limit, retry_timeout, action_id, failed_action_id, completed_action_id,"
+        "  created) select m.id, 'scheduled', t.tag, t.description, t.retry_backoff,"
+        "  t.retry_limit, t.retry_timeout, t.action_id, t.failed_action_id,"
+        "  t.completed_action_id, :now from matched m join task t on t.id = m.task_id)"
+        " insert into scheduled_task (task_id, status, occurrence, priority, parameters,"
+        "  materialized) select id, 'pending', :now, priority, parameters, false from matched")
+    FANOUT_FILTERED = (
+        " locked as (select task_id, topic, aspects, priority, activations, activation_limit"
+        "  from subscribed_task where topic in (select topic from events)"
+        "  and (activation_limit is null or activations < activation_limit) for update),"
+        " candidates as (select l.task_id, l.priority, l.activations, l.activation_limit,"
+        "  e.parameters, row_number() over (partition by l.task_id order by e.ordinal) as rank"
+        "  from events e join locked l on l.topic = e.topic"
+        "  and (l.aspects is null or e.aspects @> l.aspects))")
+    FANOUT_INDEXED = (
+        " matches (ordinal, task_id) as (values %s),"
+        " locked as (select task_id, priority, activations, activation_limit"
+        "  from subscribed_task where task_id in (%s)"
+        "  and (activation_limit is null or activations < activation_limit) for update),"
+        " candidates as (select l.task_id, l.priority, l.activations, l.activation_limit,"
+        "  e.parameters, row_number() over (partition by l.task_id order by e.ordinal) as rank"
+        "  from matches m join events e on e.ordinal = m.ordinal"
+        "  join locked l on l.task_id::text = m.task_id)")
 
     @classmethod
     def create(cls, session, topic, aspects=None):
@@ -34,14 +67,6 @@ class Event(Model):
         session.add(event)
         return event
 
-    def collate_tasks(self, session):
-        model = SubscribedTask
-        return (session.query(model).with_lockmode('update')
-            .filter(model.topic==self.topic)
-            .filter((model.activation_limit == None) | (model.activations < model.activation_limit))
-            .filter(self.HSTORE_FILTER | (model.aspects == None))
-            .params(aspects=(self.aspects or {})))
-
     def describe(self):
         aspects = {'topic': self.topic}
         if self.aspects:
@@ -49,20 +74,65 @@ class Event(Model):
         return aspects
 
     @classmethod
-    def process_events(cls, session):
-        for event in session.query(cls).with_lockmode('update').filter_by(status='pending'):
-            event.schedule_tasks(session)
-        else:
+    def fan_out(cls, session, events, index=None):
+        if not events:
+            return 0
+
+        params = {'now': current_timestamp()}
+        candidates = cls.FANOUT_FILTERED
+        if index is not None:
+            matches, subscriptions = [], {}
+            for i, event in enumerate(events):
+                for identifier in index.match(event.topic, event.aspects):
+                    position = subscriptions.setdefault(identifier, len(subscriptions))
+                    matches.append('(%d, :subscription%d)' % (i, position))
+                    params['subscription%d' % position] = identifier
+
+            if not matches:
+                return 0
+
+            candidates = cls.FANOUT_INDEXED % (', '.join(matches), ', '.join(
+                ':subscription%d' % position for position in subscriptions.itervalues()))
+
+        rows, bindparams = [], []
+        for i, event in enumerate(events):
+            rows.append('(cast(:topic%d as text), cast(:aspects%d as hstore),'
+                ' cast(:parameters%d as text), %d)' % (i, i, i, i))
+            bindparams.append(bindparam('aspects%d' % i, type_=cls.aspects.type))
+            bindparams.append(bindparam('parameters%d' % i,
+                type_=ScheduledTask.parameters.type))
+
+            params['topic%d' % i] = event.topic
+            params['aspects%d' % i] = event.aspects or {}
+            params['parameters%d' % i] = {'event': event.describe()}
+
+        statement = cls.FANOUT_STATEMENT % (', '.join(rows), candidates)
+        return session.execute(text(statement, bindparams=bindparams), params).rowcount
+
+    @classmethod
+    def has_pending_events(cls, session):
+        return session.query(cls.id).filter_by(status='pending').first() is not None
+
+    @classmethod
+    def process_events(cls, session, limit=EVENT_BATCH_SIZE, batches=EVENT_BATCH_LIMIT,
+            synchronize=None):
+        for batch in range(batches):
+            events = (session.query(cls).with_lockmode('update').filter_by(status='pending')
+                .order_by(cls.occurrence).limit(limit).all())
+            if not events:
+                return session.commit()
+
+            index = (synchronize(session) if synchronize else None)
+            spawned = cls.fan_out(session, events, index)
+            for event in events:
+                event.status = 'completed'
+
             session.commit()
+            metrics.counter('platoon_event_activations',
+                'Number of subscribed task activations spawned by events.').inc(spawned)
 
     @classmethod
     def purge(cls, session, lifetime):
         delta = datetime.now(UTC) - timedelta(days=lifetime)
         session.query(cls).filter(cls.status == 'completed', cls.occurrence < delta).delete()
 
-    def schedule_tasks(self, session):
-        description = self.describe()
-        for task in self.collate_tasks(session):
-            task.activate(session, description)
-
-        self.status = 'completed'
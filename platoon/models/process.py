@@ -7,6 +7,7 @@ from spire.schema import *
 from spire.support.logs import LogHelper
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm.collections import attribute_mapped_collection
+from sqlalchemy.sql.expression import func, literal_column
 
 from platoon.constants import *
 from platoon.queue import ThreadPackage
@@ -134,6 +135,13 @@ class Process(Model):
         if state:
             self.state = state
 
+    @classmethod
+    def next_deadline(cls, session):
+        deadline = cls.started + (literal_column("interval '1 minute'") * cls.timeout)
+        return (session.query(func.min(deadline))
+            .filter(cls.timeout != None, cls.started != None, cls.status == 'executing')
+            .filter(deadline > current_timestamp()).scalar())
+
     @classmethod
     def process_processes(cls, taskqueue, session):
         occurrence = current_timestamp()
@@ -145,25 +153,34 @@ class Process(Model):
                 log('info', 'abandoning %r due to timing out', process)
                 taskqueue.enqueue(process, 'abandon')
 
+    def prepare_report(self, action):
+        if action == 'report-abortion':
+            return self.endpoint, self._construct_payload(status='aborting', for_executor=True)
+        elif action == 'report-end':
+            return self.queue.endpoint, self._construct_payload(status=self.status,
+                output=self.output)
+        elif action == 'report-progress':
+            return self.queue.endpoint, self._construct_payload(status='executing',
+                progress=self.progress)
+        elif action == 'report-timeout-to-executor':
+            return self.endpoint, self._construct_payload(status='timedout', for_executor=True)
+        elif action == 'report-timeout-to-queue':
+            return self.queue.endpoint, self._construct_payload(status='timedout')
+
     def report_abortion(self, session):
-        payload = self._construct_payload(status='aborting', for_executor=True)
-        return self.endpoint.request(payload)
+        return self._report('report-abortion')
 
     def report_end(self, session):
-        payload = self._construct_payload(status=self.status, output=self.output)
-        return self.queue.endpoint.request(payload)
+        return self._report('report-end')
 
     def report_progress(self, session):
-        payload = self._construct_payload(status='executing', progress=self.progress)
-        return self.queue.endpoint.request(payload)
+        return self._report('report-progress')
 
     def report_timeout_to_executor(self, session):
-        payload = self._construct_payload(status='timedout', for_executor=True)
-        return self.endpoint.request(payload)
+        return self._report('report-timeout-to-executor')
 
     def report_timeout_to_queue(self, session):
-        payload = self._construct_payload(status='timedout')
-        return self.queue.endpoint.request(payload)
+        return self._report('report-timeout-to-queue')
 
     def update(self, session, status=None, output=None, progress=None, state=None):
         if status == 'aborting':
@@ -213,6 +230,10 @@ class Process(Model):
             params['state'] = self.state
         return params
 
+    def _report(self, action):
+        endpoint, payload = self.prepare_report(action)
+        return endpoint.request(payload)
+
     def _schedule_task(self, session, action, delta=None, limit=0, timeout=120, backoff=1.4):
         self.tasks[action] = ScheduledTask.create(session,
             tag='%s:%s' % (action, self.tag),
@@ -220,7 +241,8 @@ class Process(Model):
             delta=delta,
             retry_limit=limit,
             retry_timeout=timeout,
-            retry_backoff=backoff)
+            retry_backoff=backoff,
+            priority=PROCESS_TASK_PRIORITIES.get(action, DEFAULT_PRIORITY))
 
 class ProcessTask(Model):
     """A process task."""
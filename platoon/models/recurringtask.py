@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from scheme import UTC, current_timestamp
 from spire.schema import *
 from spire.support.logs import LogHelper
+from sqlalchemy.sql import text
 
 from platoon.constants import *
 from platoon.models.action import TaskAction
@@ -24,17 +25,27 @@ class RecurringTask(Task):
     task_id = ForeignKey('task.id', nullable=False, primary_key=True, ondelete='CASCADE')
     status = Enumeration('active inactive', nullable=False, default='active')
     schedule_id = ForeignKey('schedule.id', nullable=False)
+    priority = Integer(nullable=False, default=DEFAULT_PRIORITY)
+    horizon = Integer()
+    frontier = DateTime(timezone=True)
 
     schedule = relationship('Schedule')
 
+    HORIZON_STATEMENT = ("select task_id from recurring_task r"
+        " where status = 'active' and horizon is not null and horizon >"
+        " (select count(*) from scheduled_task s where s.parent_id = r.task_id"
+        " and s.status = 'pending') order by frontier nulls first limit :limit for update")
+
     @classmethod
     def create(cls, session, tag, action, schedule_id, status='active',
             failed_action=None, completed_action=None, description=None,
-            retry_backoff=None, retry_limit=2, retry_timeout=300, id=None):
+            retry_backoff=None, retry_limit=2, retry_timeout=300, id=None,
+            priority=DEFAULT_PRIORITY, horizon=None):
 
         task = RecurringTask(tag=tag, status=status, description=description,
             schedule_id=schedule_id, retry_backoff=retry_backoff,
-            retry_limit=retry_limit, retry_timeout=retry_timeout, id=id)
+            retry_limit=retry_limit, retry_timeout=retry_timeout, id=id,
+            priority=priority, horizon=horizon)
 
         task.action = TaskAction.polymorphic_create(action)
         if failed_action:
@@ -53,10 +64,81 @@ class RecurringTask(Task):
         query = session.query(ScheduledTask).filter_by(parent_id=self.id, status='pending')
         return query.count() >= 1
 
+    def materialize(self, session):
+        from platoon.models.scheduledtask import ScheduledTask
+        if self.status != 'active' or not self.horizon:
+            return []
+
+        query = session.query(ScheduledTask).filter_by(status='pending', parent_id=self.id)
+        required = self.horizon - query.count()
+        if required <= 0:
+            return []
+
+        start, frontier = current_timestamp(), self.frontier
+        if frontier and frontier > start:
+            start = frontier
+
+        occurrences = [occurrence for occurrence in self.schedule.occurrences(start,
+            limit=required + 1, origin=frontier) if occurrence > start]
+
+        tasks = []
+        for occurrence in occurrences[:required]:
+            tasks.append(ScheduledTask.spawn(self, occurrence, parent_id=self.id,
+                materialized=True))
+
+        if tasks:
+            session.add_all(tasks)
+            self.frontier = tasks[-1].occurrence
+        return tasks
+
+    @classmethod
+    def rebuild_horizons(cls, session, tasks):
+        from platoon.models.scheduledtask import ScheduledTask
+        if not tasks:
+            return
+
+        identifiers = [task.id for task in tasks]
+        subquery = session.query(ScheduledTask.task_id).filter(
+            ScheduledTask.parent_id.in_(identifiers), ScheduledTask.materialized == True,
+            ScheduledTask.status == 'pending', ScheduledTask.occurrence > current_timestamp())
+
+        session.query(Task).filter(Task.id.in_(subquery)).delete(synchronize_session=False)
+
+        for task in tasks:
+            task.frontier = None
+            if task.horizon:
+                task.materialize(session)
+            else:
+                session.query(ScheduledTask).filter(ScheduledTask.parent_id == task.id,
+                    ScheduledTask.materialized == True, ScheduledTask.status == 'pending').update(
+                    {'materialized': False}, synchronize_session=False)
+                task.reschedule(session)
+
+    @classmethod
+    def replenish_horizons(cls, session, limit, skip_locked=False):
+        statement = cls.HORIZON_STATEMENT
+        if skip_locked:
+            statement += ' skip locked'
+
+        rows = session.execute(text(statement), {'limit': limit})
+        identifiers = [row[0] for row in rows]
+        if not identifiers:
+            return 0
+
+        materialized = 0
+        for task in session.query(cls).filter(cls.task_id.in_(identifiers)):
+            try:
+                materialized += len(task.materialize(session))
+            except Exception:
+                log('exception', 'failed to materialize the horizon of %s', repr(task))
+        return materialized
+
     def reschedule(self, session, occurrence=None):
         from platoon.models.scheduledtask import ScheduledTask
         if self.status != 'active':
             return
+        if self.horizon:
+            return self.materialize(session)
 
         query = session.query(ScheduledTask).filter_by(status='pending', parent_id=self.id)
         if query.count() > 0:
@@ -72,6 +154,10 @@ class RecurringTask(Task):
         return task
 
     def update(self, session, action=None, failed_action=None, completed_action=None, **params):
+        rebuild = ('horizon' in params and params['horizon'] != self.horizon) or (self.horizon
+            and any(params.get(attr, getattr(self, attr)) != getattr(self, attr)
+                for attr in ('schedule_id', 'status')))
+
         self.update_with_mapping(params)
         if action:
             self.action.update_with_mapping(action)
@@ -87,5 +173,7 @@ class RecurringTask(Task):
                 self.completed_action = TaskAction.polymorphic_create(completed_action)
 
         session.flush()
-        if self.status == 'active' and not self.has_pending_task(session):
+        if rebuild:
+            RecurringTask.rebuild_horizons(session, [self])
+        elif self.status == 'active' and not self.has_pending_task(session):
             self.reschedule(session, datetime.now(UTC))
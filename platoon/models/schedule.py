@@ -43,13 +43,45 @@ class Schedule(Model):
             occurrence = now
         return self._next_occurrence(occurrence)
 
+    def occurrences(self, start=None, end=None, limit=None, origin=None):
+        start = start or current_timestamp()
+        occurrence = self._locate_origin(start, origin)
+        occurrences = []
+
+        while not limit or len(occurrences) < limit:
+            next = self._next_occurrence(occurrence, occurrence.astimezone(UTC))
+            if next <= occurrence or (end and next > end):
+                break
+
+            if next >= start:
+                occurrences.append(next)
+            occurrence = next
+
+        return occurrences
+
+    def peek_next(self):
+        cached_next = self.cached_next
+        if cached_next and cached_next > current_timestamp():
+            return cached_next
+        return self.next(None, cache_results=False)
+
     def update(self, session, **attrs):
+        from platoon.models.recurringtask import RecurringTask
         self.update_with_mapping(attrs)
+        self.cached_next = None
+        specifications.invalidate(self.id)
         try:
             session.flush()
         except IntegrityError:
             raise OperationError(token='duplicate-schedule-name')
 
+        tasks = session.query(RecurringTask).with_lockmode('update').filter(
+            RecurringTask.schedule_id == self.id, RecurringTask.horizon != None).all()
+        RecurringTask.rebuild_horizons(session, tasks)
+
+    def _locate_origin(self, start, origin=None):
+        return start
+
 class FixedSchedule(Schedule):
     """A fixed task schedule."""
 
@@ -62,10 +94,12 @@ class FixedSchedule(Schedule):
     anchor = DateTime(nullable=False, timezone=True)
     interval = Integer(nullable=False)
 
+    cached_next = None
+
     def describe(self):
         return 'Every %d seconds' % self.interval
 
-    def _next_occurrence(self, occurrence):
+    def _next_occurrence(self, occurrence, now=None):
         occurrence = occurrence + timedelta(seconds=self.interval)
         if occurrence >= self.anchor:
             return occurrence
@@ -87,16 +121,40 @@ class LogicalSchedule(Schedule):
     weekday = Text()
     hour = Text()
     minute = Text()
+    cached_next = DateTime(timezone=True)
 
     def describe(self):
         return 'logical'
 
-    def _next_occurrence(self, occurrence):
-        if self.anchor and occurrence < self.anchor:
-            occurrence = self.anchor
+    def next(self, *args, **params):
+        occurrence = params.get('occurrence', None)
+        now = current_timestamp()
+        if not occurrence or occurrence < now:
+            occurrence = now
+
+        cached_next = self.cached_next
+        if cached_next and occurrence <= cached_next:
+            return cached_next
+
+        next = self._next_occurrence(occurrence)
+        if params.get('cache_results', True) and next != cached_next:
+            self.cached_next = next
+        return next
+
+    def occurrences(self, start=None, end=None, limit=None, origin=None):
+        start = start or current_timestamp()
+        if self.anchor and start < self.anchor:
+            start = self.anchor
+        return self._acquire_specification().occurrences(start, end, limit)
 
+    def _acquire_specification(self):
         specification = (self.month, self.day, self.weekday, self.hour, self.minute)
-        return Specification(specification).next(occurrence)
+        return specifications.acquire(self.id, specification)
+
+    def _next_occurrence(self, occurrence, now=None):
+        if self.anchor and occurrence < self.anchor:
+            occurrence = self.anchor
+        return self._acquire_specification().next(occurrence)
 
 class MonthlySchedule(Schedule):
     """A monthly task schedule."""
@@ -143,24 +201,59 @@ class MonthlySchedule(Schedule):
             occurrence = self.anchor
 
         next = self._next_occurrence(occurrence)
-        if cache_results:
+        if cache_results and next != cached_next:
             self.cached_next = next
 
         return next
 
-    def _next_occurrence(self, occurrence):
+    def _locate_origin(self, start, origin=None):
+        candidates = []
+        if origin and origin <= start:
+            candidates.append(origin)
+        if self.cached_next and self.cached_next < start:
+            candidates.append(self.cached_next)
+
+        period = self._locate_period(start)
+        if period:
+            candidates.append(period)
+
+        if candidates:
+            return max(candidates)
+        return self.anchor - timedelta(minutes=1)
+
+    def _locate_period(self, start):
+        anchor = self.anchor
+        if self.strategy == 'day':
+            step, last = anchor.day, 28
+        else:
+            step, last = identify_weekday_step(anchor), 4
+
+        # the chain only stays in phase with the anchor when every month has a match
+        if step > last or (step == 1 and anchor.hour == 0 and anchor.minute == 0):
+            return None
+
+        start = start.astimezone(anchor.tzinfo)
+        months = (start.year - anchor.year) * 12 + start.month - anchor.month
+        periods = months // self.interval
+        if periods < 2:
+            return None
+
+        period = anchor.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return advance_by_month(period, (periods - 1) * self.interval)
+
+    def _next_occurrence(self, occurrence, now=None):
         anchor = self.anchor
         if occurrence < anchor:
             occurrence = anchor
 
         if self.strategy == 'day':
-            specification = Specification(['*', str(anchor.day), '*',
-                str(anchor.hour), str(anchor.minute)])
+            specification = ['*', str(anchor.day), '*', str(anchor.hour), str(anchor.minute)]
         elif self.strategy == 'weekday':
-            specification = Specification(['*', '*', construct_weekday_step(anchor),
-                str(anchor.hour), str(anchor.minute)])
+            specification = ['*', '*', construct_weekday_step(anchor),
+                str(anchor.hour), str(anchor.minute)]
 
-        return specification.next_monthly_interval(self.interval, occurrence)
+        specification = specifications.acquire(self.id, specification)
+        return specification.next_monthly_interval(self.interval, occurrence, now)
 
 class WeeklySchedule(Schedule):
     """A weekly task schedule."""
@@ -220,12 +313,37 @@ class WeeklySchedule(Schedule):
             occurrence = self.anchor
 
         next = self._next_occurrence(occurrence)
-        if cache_results:
+        if cache_results and next != cached_next:
             self.cached_next = next
 
         return next
 
-    def _next_occurrence(self, occurrence):
+    def _locate_origin(self, start, origin=None):
+        candidates = []
+        if origin and origin <= start:
+            candidates.append(origin)
+        if self.cached_next and self.cached_next < start:
+            candidates.append(self.cached_next)
+
+        period = self._locate_period(start)
+        if period:
+            candidates.append(period)
+
+        if candidates:
+            return max(candidates)
+        return self.anchor - timedelta(minutes=1)
+
+    def _locate_period(self, start):
+        week = Week.from_date(self.anchor.astimezone(UTC))
+        weeks = (Week.from_date(start.astimezone(UTC)).start - week.start).days // 7
+        periods = weeks // self.interval
+        if periods < 2:
+            return None
+
+        period = week.start + timedelta(days=7 * (periods - 1) * self.interval)
+        return datetime(period.year, period.month, period.day, tzinfo=UTC)
+
+    def _next_occurrence(self, occurrence, now=None):
         anchor = self.anchor.astimezone(UTC)
         occurrence = occurrence.astimezone(UTC)
         if occurrence < anchor:
@@ -236,7 +354,7 @@ class WeeklySchedule(Schedule):
             if getattr(self, token):
                 weekdays.append(str(i + 1))
 
-        specification = Specification(['*', '*', ';'.join(weekdays),
+        specification = specifications.acquire(self.id, ['*', '*', ';'.join(weekdays),
             str(anchor.hour), str(anchor.minute)])
         return specification.next_weekly_interval(self.interval,
-            occurrence).replace(tzinfo=UTC)
+            occurrence, now).replace(tzinfo=UTC)
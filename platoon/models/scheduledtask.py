@@ -4,12 +4,18 @@ from traceback import format_exc
 from scheme import UTC, current_timestamp
 from spire.schema import *
 from spire.support.logs import LogHelper
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql import text
+from sqlalchemy.sql.expression import func
 
 from platoon.constants import *
 from platoon.queue import ThreadPackage
+from platoon.support.metrics import registry as metrics
 from platoon.models.action import InternalAction, TaskAction
 from platoon.models.recurringtask import RecurringTask
 from platoon.models.task import *
+from platoon.models.taskhistogram import TaskHistogram
+from platoon.models.worker import Worker
 
 __all__ = ('ScheduledTask',)
 
@@ -28,8 +34,14 @@ class ScheduledTask(Task):
     status = Enumeration('pending executing retrying aborted completed failed',
         nullable=False, default='pending')
     occurrence = DateTime(nullable=False, timezone=True)
+    due = DateTime(timezone=True)
+    priority = Integer(nullable=False, default=DEFAULT_PRIORITY)
     parent_id = ForeignKey('recurring_task.task_id', ondelete='CASCADE')
+    materialized = Boolean(nullable=False, default=False)
     parameters = Serialized()
+    worker_id = ForeignKey('worker.id', ondelete='SET NULL')
+    claimed = DateTime(timezone=True)
+    lease = DateTime(timezone=True)
 
     parent = relationship(
         'RecurringTask',
@@ -39,13 +51,23 @@ class ScheduledTask(Task):
         TaskExecution, backref='task', order_by='TaskExecution.attempt',
         cascade='all', passive_deletes=True)
 
+    CLAIM_STATEMENT = ("select task_id, priority, occurrence from scheduled_task"
+        " where status in ('pending', 'retrying') and occurrence <= :occurrence%s"
+        " order by priority, occurrence, task_id limit :limit for update")
+    CLAIM_KEYSET = (" and (priority, occurrence, task_id)"
+        " > (:priority, :after, cast(:task_id as uuid))")
+    LEASE_STATEMENT = ("select task_id from scheduled_task"
+        " where status = 'executing' and lease < :now"
+        " order by lease limit :limit for update")
+
     def __repr__(self):
         return 'ScheduledTask(id=%r, tag=%r)' % (self.id, self.tag)
 
     @classmethod
     def create(cls, session, tag, action, status='pending', occurrence=None,
             failed_action=None, completed_action=None, description=None,
-            retry_backoff=None, retry_limit=2, retry_timeout=300, delta=None):
+            retry_backoff=None, retry_limit=2, retry_timeout=300, delta=None,
+            priority=DEFAULT_PRIORITY):
 
         if not occurrence:
             occurrence = current_timestamp()
@@ -54,7 +76,7 @@ class ScheduledTask(Task):
 
         task = ScheduledTask(tag=tag, status=status, description=description,
             occurrence=occurrence, retry_backoff=retry_backoff,
-            retry_limit=retry_limit, retry_timeout=retry_timeout)
+            retry_limit=retry_limit, retry_timeout=retry_timeout, priority=priority)
 
         if isinstance(action, dict):
             if action['type'] == 'internal':
@@ -82,70 +104,135 @@ class ScheduledTask(Task):
         session.add(task)
         return task
 
-    def execute(self, session):
-        parent = None
-        if self.parent_id:
-            parent = RecurringTask.load(session, id=self.parent_id, lockmode='update')
+    def complete(self, session, started, claimed=None, response=None, error=None):
+        if error is not None:
+            status, result = FAILED, '%s: %s' % (type(error).__name__, error)
+        else:
+            try:
+                status, result = self.action.interpret_response(self, session, response)
+            except Exception:
+                status, result = FAILED, format_exc()
 
-        execution = TaskExecution(task_id=self.id, attempt=len(self.executions) + 1)
-        session.add(execution)
+        self._record_execution(session, started, status, result, claimed)
+
+    def execute(self, session, started=None, claimed=None):
+        if not started:
+            started = datetime.now(UTC)
+            self._observe_dispatch(started)
 
-        execution.started = datetime.now(UTC)
         try:
-            status, execution.result = self.action.execute(self, session)
+            status, result = self.action.execute(self, session)
         except Exception, exception:
-            status = FAILED
-            execution.result = format_exc()
+            status, result = FAILED, format_exc()
 
-        execution.completed = datetime.now(UTC)
-        if status == COMPLETED:
-            self.status = execution.status = 'completed'
-            log('info', '%s completed (attempt %d)', repr(self), execution.attempt)
-            log('debug', 'result for %s:\n%s', repr(self), execution.result)
-            if self.completed_action_id:
-                session.add(Task(tag='%s-completed' % self.tag, occurrence=datetime.now(UTC),
-                    action_id=self.completed_action_id))
-        elif execution.attempt == (self.retry_limit + 1):
-            self.status = execution.status = 'failed'
-            log('error', '%s failed (attempt %d), aborting', repr(self), execution.attempt)
-            log('debug', 'result for %s:\n%s', repr(self), execution.result)
-            if self.failed_action_id:
-                session.add(Task(tag='%s-failed' % self.tag, occurrence=datetime.now(UTC),
-                    action_id=self.failed_action_id))
-        else:
-            execution.status = 'failed'
-            self.status = 'retrying'
-            self.occurrence = self._calculate_retry(execution)
-            if status == FAILED:
-                log('warning', '%s failed (attempt %d), retrying', repr(self), execution.attempt)
-            else:
-                log('info', '%s not yet complete (attempt %s), retrying',
-                    repr(self), execution.attempt)
-            log('debug', 'result for %s:\n%s', repr(self), execution.result)
+        self._record_execution(session, started, status, result, claimed)
 
-        if parent:
-            parent.reschedule(session, self.occurrence)
-        """instead of leaving a completed task in the table, delete it now."""
-        if status == COMPLETED:
-            session.query(Task).filter_by(id = self.task_id).delete(synchronize_session=False)
+    def initiate(self, session, taskqueue, claimed=None):
+        started = datetime.now(UTC)
+        self._observe_dispatch(started)
+
+        try:
+            request = self.action.prepare_request(self, session)
+            if request is not None:
+                return taskqueue.dispatch(self, request, 'complete', started=started,
+                    claimed=claimed)
+        except Exception:
+            return self._record_execution(session, started, FAILED, format_exc(), claimed)
+
+        self.execute(session, started, claimed)
 
     @classmethod
-    def process_tasks(cls, taskqueue, session):
+    def next_occurrence(cls, session, after=None):
+        query = session.query(func.min(cls.occurrence)).filter(
+            cls.status.in_(('pending', 'retrying')))
+        if after is not None:
+            query = query.filter(cls.occurrence > after)
+        return query.scalar()
+
+    @classmethod
+    def claim_tasks(cls, session, worker_id, limit, skip_locked=False, admit=None,
+            lease=None):
         occurrence = current_timestamp()
-        tasks = list(session.query(cls).with_lockmode('update').filter(
-            cls.status.in_(('pending', 'retrying')),
-            cls.occurrence <= occurrence))
+        window = (limit * CLAIM_WINDOW if admit else limit)
+        params = {'occurrence': occurrence, 'limit': window}
+
+        tasks, keyset = [], ''
+        while len(tasks) < limit:
+            statement = cls.CLAIM_STATEMENT % keyset
+            if skip_locked:
+                statement += ' skip locked'
+
+            rows = session.execute(text(statement), params).fetchall()
+            if not rows:
+                break
+
+            query = session.query(cls).filter(cls.task_id.in_([row[0] for row in rows]))
+            if admit:
+                query = query.options(joinedload(cls.action))
 
+            for task in query.order_by(cls.priority, cls.occurrence, cls.task_id):
+                if len(tasks) >= limit:
+                    break
+                if admit and not admit(task):
+                    continue
+
+                if task.due is None:
+                    task.due = task.occurrence
+
+                task.status = 'executing'
+                task.worker_id = worker_id
+                task.claimed = occurrence
+                if lease:
+                    task.lease = occurrence + timedelta(seconds=lease)
+                tasks.append(task)
+
+            if not admit or len(rows) < window:
+                break
+
+            params['task_id'], params['priority'], params['after'] = rows[-1]
+            keyset = cls.CLAIM_KEYSET
+
+        return tasks
+
+    @classmethod
+    def process_tasks(cls, taskqueue, session):
+        limit = taskqueue.calculate_claim_limit()
+        if not limit:
+            return
+
+        configuration = taskqueue.configuration
+        admission = taskqueue.admit()
+        tasks = cls.claim_tasks(session, taskqueue.worker_id, limit,
+            configuration['claim_mode'] == 'skip-locked',
+            (admission if admission.selective else None), configuration['lease_duration'])
+
+        taskqueue.deferred, taskqueue.delay = admission.deferred, admission.delay
+        metrics.histogram('platoon_tasks_claimed',
+            'Number of tasks claimed per claim cycle.', CLAIM_BUCKETS).observe(len(tasks))
         if not tasks:
             return
 
-        for task in tasks:
-            task.status = 'executing'
+        claimed = dict((task.id, task.claimed) for task in tasks)
+        try:
+            session.commit()
+        except Exception:
+            admission.cancel()
+            raise
 
-        session.commit()
         for task in tasks:
             log('info', 'processing %s', repr(task))
-            taskqueue.enqueue(task, 'execute')
+            claim = admission.claim(task.id)
+            if taskqueue.dispatcher:
+                taskqueue.enqueue(task, 'initiate', claim, taskqueue=taskqueue,
+                    claimed=claimed[task.id])
+            else:
+                taskqueue.enqueue(task, 'execute', claim, claimed=claimed[task.id])
+
+    @classmethod
+    def query_near_term_tasks(cls, session, now, horizon, limit):
+        return session.query(cls.task_id, cls.occurrence).filter(
+            cls.status.in_(('pending', 'retrying')), cls.occurrence > now,
+            cls.occurrence <= horizon).order_by(cls.occurrence).limit(limit).all()
 
     @classmethod
     def purge(cls, session, lifetime):
@@ -158,8 +245,44 @@ class ScheduledTask(Task):
             Task.id.in_(subquery)).delete(synchronize_session=False)
 
     @classmethod
-    def retry_executing_tasks(cls, session):
+    def recover_expired_leases(cls, session, limit, skip_locked=False):
+        statement = cls.LEASE_STATEMENT
+        if skip_locked:
+            statement += ' skip locked'
+
+        rows = session.execute(text(statement), {'now': current_timestamp(), 'limit': limit})
+        identifiers = [row[0] for row in rows]
+        if not identifiers:
+            return 0
+
+        for task in session.query(cls).filter(cls.task_id.in_(identifiers)):
+            log('warning', 'recovering %s after its lease expired', repr(task))
+            task.worker_id = task.lease = None
+            task._retry_or_fail(session)
+        return len(identifiers)
+
+    @classmethod
+    def release_tasks(cls, session, worker_id, identifiers):
+        session.query(cls).filter(cls.task_id.in_(identifiers), cls.worker_id == worker_id,
+            cls.status == 'executing').update({'status': 'pending', 'worker_id': None,
+            'claimed': None, 'lease': None}, synchronize_session=False)
+
+    @classmethod
+    def renew_leases(cls, session, worker_id, identifiers, lease):
+        expiry = current_timestamp() + timedelta(seconds=lease)
+        for offset in range(0, len(identifiers), 500):
+            session.query(cls).filter(cls.task_id.in_(identifiers[offset:offset + 500]),
+                cls.worker_id == worker_id, cls.status == 'executing').update(
+                {'lease': expiry}, synchronize_session=False)
+
+    @classmethod
+    def retry_executing_tasks(cls, session, worker_id=None, timeout=None):
         tasks = session.query(cls).with_lockmode('update').filter(cls.status=='executing')
+        if worker_id:
+            dead_workers = Worker.query_dead_workers(session, timeout).subquery()
+            tasks = tasks.filter((cls.worker_id == None) | (cls.worker_id == worker_id)
+                | cls.worker_id.in_(dead_workers))
+
         for task in tasks:
             log('info', 'recovering %s', repr(task))
             task._retry_or_fail(session)
@@ -172,16 +295,19 @@ class ScheduledTask(Task):
         return cls(tag=template.tag, status='pending', description=template.description,
             occurrence=occurrence, retry_backoff=template.retry_backoff,
             retry_limit=template.retry_limit, retry_timeout=template.retry_timeout,
-            action_id=template.action_id, failed_action_id=template.failed_action_id,
+            priority=template.priority, action_id=template.action_id,
+            failed_action_id=template.failed_action_id,
             completed_action_id=template.completed_action_id, **params)
 
-    def update(self, session, occurrence=None, **data):
+    def update(self, session, occurrence=None, priority=None, **data):
         session.refresh(self, lockmode='update')
-        if occurrence is not None:
-            if self.status == 'pending':
-                self.occurrence = occurrence
-            else:
+        if occurrence is not None or priority is not None:
+            if self.status != 'pending':
                 raise OperationError(token='cannot-update-task')
+            if occurrence is not None:
+                self.occurrence = occurrence
+            if priority is not None:
+                self.priority = priority
 
     def _calculate_retry(self, execution=None):
         timeout = self.retry_timeout
@@ -189,6 +315,74 @@ class ScheduledTask(Task):
             timeout *= (self.retry_backoff ** execution.attempt)
         return datetime.now(UTC) + timedelta(seconds=timeout)
 
+    def _record_execution(self, session, started, status, result, claimed=None):
+        if claimed is None:
+            claimed = self.claimed
+
+        session.refresh(self, lockmode='update')
+        if self.status != 'executing' or self.claimed != claimed:
+            log('warning', '%s lost its claim before completing, discarding result', repr(self))
+            return self._observe_outcome('discarded')
+
+        parent = None
+        if self.parent_id and not self.materialized:
+            parent = RecurringTask.load(session, id=self.parent_id, lockmode='update')
+
+        execution = TaskExecution(task_id=self.id, attempt=len(self.executions) + 1,
+            due=self.due or self.occurrence, started=started, result=result)
+        session.add(execution)
+
+        execution.completed = datetime.now(UTC)
+        TaskHistogram.observe(self.tag, 'lag',
+            max((started - execution.due).total_seconds(), 0), started)
+        TaskHistogram.observe(self.tag, 'latency',
+            (execution.completed - started).total_seconds(), started)
+        if status == COMPLETED:
+            self.status = execution.status = 'completed'
+            log('info', '%s completed (attempt %d)', repr(self), execution.attempt)
+            log('debug', 'result for %s:\n%s', repr(self), execution.result)
+            if self.completed_action_id:
+                session.add(Task(tag='%s-completed' % self.tag, occurrence=datetime.now(UTC),
+                    action_id=self.completed_action_id))
+        elif execution.attempt == (self.retry_limit + 1):
+            self.status = execution.status = 'failed'
+            log('error', '%s failed (attempt %d), aborting', repr(self), execution.attempt)
+            log('debug', 'result for %s:\n%s', repr(self), execution.result)
+            if self.failed_action_id:
+                session.add(Task(tag='%s-failed' % self.tag, occurrence=datetime.now(UTC),
+                    action_id=self.failed_action_id))
+        else:
+            execution.status = 'failed'
+            self.status = 'retrying'
+            self.occurrence = self._calculate_retry(execution)
+            if status == FAILED:
+                log('warning', '%s failed (attempt %d), retrying', repr(self), execution.attempt)
+            else:
+                log('info', '%s not yet complete (attempt %s), retrying',
+                    repr(self), execution.attempt)
+            log('debug', 'result for %s:\n%s', repr(self), execution.result)
+
+        metrics.histogram('platoon_task_execution_seconds',
+            'Execution latency of tasks by action type.').observe(
+            (execution.completed - started).total_seconds(), type=self.action.type)
+        self._observe_outcome(self.status)
+
+        if parent:
+            parent.reschedule(session, self.occurrence)
+        """instead of leaving a completed task in the table, delete it now."""
+        if status == COMPLETED:
+            session.query(Task).filter_by(id = self.task_id).delete(synchronize_session=False)
+
+    def _observe_dispatch(self, started):
+        metrics.histogram('platoon_dispatch_lag_seconds',
+            'Delay between the due time of tasks and the start of their execution.').observe(
+            max((started - self.occurrence).total_seconds(), 0), type=self.action.type)
+
+    def _observe_outcome(self, outcome):
+        metrics.counter('platoon_task_outcomes',
+            'Number of task executions by action type and outcome.').inc(
+            type=self.action.type, outcome=outcome)
+
     def _retry_or_fail(self, session):
         attempts = len(self.executions)
         if attempts < self.retry_limit:
@@ -197,8 +391,17 @@ class ScheduledTask(Task):
             return
 
         self.status = 'failed'
-        if self.parent_id:
+        if self.parent_id and not self.materialized:
             parent = RecurringTask.load(session, id=self.parent_id, lockmode='update')
             parent.reschedule(session)
 
         log('error', '%s marked as failed', repr(self))
+
+ScheduledTaskDispatchIndex = Index('scheduled_task_dispatch_idx', ScheduledTask.priority,
+    ScheduledTask.occurrence, postgresql_where=ScheduledTask.status.in_(('pending', 'retrying')))
+
+ScheduledTaskParentIndex = Index('scheduled_task_parent_idx', ScheduledTask.parent_id,
+    postgresql_where=ScheduledTask.status == 'pending')
+
+ScheduledTaskLeaseIndex = Index('scheduled_task_lease_idx', ScheduledTask.lease,
+    postgresql_where=ScheduledTask.status == 'executing')
@@ -3,11 +3,11 @@ from datetime import timedelta
 from scheme import current_timestamp
 from spire.schema import *
 from spire.support.logs import LogHelper
+from sqlalchemy.sql import text
 from sqlalchemy.sql.expression import func
 
 from platoon.constants import *
 from platoon.models.action import TaskAction
-from platoon.models.scheduledtask import ScheduledTask
 from platoon.models.task import Task
 
 __all__ = ('SubscribedTask',)
@@ -30,27 +30,23 @@ class SubscribedTask(Task):
     activations = Integer(nullable=False, default=0)
     activated = DateTime(timezone=True)
     timeout = Integer()
+    priority = Integer(nullable=False, default=DEFAULT_PRIORITY)
 
-    def activate(self, session, description):
-        limit = self.activation_limit
-        if limit is not None and self.activations > limit:
-            return
-
-        task = ScheduledTask.spawn(self, parameters={'event': description})
-        session.add(task)
-
-        self.activations += 1
-        self.activated = current_timestamp()
-        return task
+    @classmethod
+    def announce(cls, session, identifier):
+        session.execute(text('select pg_notify(:channel, :identifier)'),
+            {'channel': SUBSCRIPTION_CHANNEL, 'identifier': identifier})
 
     @classmethod
     def create(cls, session, tag, action, topic, aspects=None, activation_limit=None,
             failed_action=None, completed_action=None, description=None,
-            retry_backoff=None, retry_limit=2, retry_timeout=300, timeout=None, id=None):
+            retry_backoff=None, retry_limit=2, retry_timeout=300, timeout=None, id=None,
+            priority=DEFAULT_PRIORITY):
 
         task = SubscribedTask(id=id, tag=tag, description=description, topic=topic,
             aspects=aspects, activation_limit=activation_limit, retry_backoff=retry_backoff,
-            retry_limit=retry_limit, retry_timeout=retry_timeout, timeout=timeout)
+            retry_limit=retry_limit, retry_timeout=retry_timeout, timeout=timeout,
+            priority=priority)
 
         task.action = TaskAction.polymorphic_create(action)
         if failed_action:
@@ -61,6 +57,22 @@ class SubscribedTask(Task):
         session.add(task)
         return task
 
+    @classmethod
+    def index_subscriptions(cls, session, index, identifiers=None):
+        query = session.query(cls.task_id, cls.topic, cls.aspects).filter(
+            (cls.activation_limit == None) | (cls.activations < cls.activation_limit))
+
+        if identifiers is None:
+            return index.replace(query)
+
+        identifiers = set(identifiers)
+        for identifier, topic, aspects in query.filter(cls.task_id.in_(identifiers)):
+            index.add(identifier, topic, aspects)
+            identifiers.discard(identifier)
+
+        for identifier in identifiers:
+            index.discard(identifier)
+
     @classmethod
     def purge(cls, session, lifetime):
         subquery = session.query(cls.task_id).filter(
@@ -21,6 +21,7 @@ class TaskExecution(Model):
     task_id = ForeignKey('scheduled_task.task_id', nullable=False, ondelete='CASCADE')
     attempt = Integer(nullable=False)
     status = Enumeration('completed failed')
+    due = DateTime(timezone=True)
     started = DateTime(timezone=True)
     completed = DateTime(timezone=True)
     result = Text()
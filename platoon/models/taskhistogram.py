@@ -0,0 +1,134 @@
+import threading
+from bisect import bisect_left
+from datetime import timedelta
+
+from scheme import current_timestamp
+from spire.schema import *
+from sqlalchemy.sql.expression import func
+
+from platoon.constants import *
+
+__all__ = ('TaskHistogram',)
+
+schema = Schema('platoon')
+
+guard = threading.Lock()
+observations = {}
+
+class TaskHistogram(Model):
+    """A bucket of a rolling per-tag histogram of task timings."""
+
+    class meta:
+        schema = schema
+        tablename = 'task_histogram'
+
+    tag = Text(nullable=False, primary_key=True)
+    metric = Enumeration('lag latency', nullable=False, primary_key=True)
+    period = DateTime(timezone=True, nullable=False, primary_key=True)
+    bucket = Integer(nullable=False, primary_key=True)
+    count = Integer(nullable=False, default=0)
+    total = Float(nullable=False, default=0)
+
+    @classmethod
+    def aggregate(cls, session, tag=None, metric=None, since=None, until=None):
+        query = session.query(cls.tag, cls.metric, cls.bucket, func.sum(cls.count),
+            func.sum(cls.total)).group_by(cls.tag, cls.metric, cls.bucket)
+
+        if tag:
+            query = query.filter(cls.tag == tag)
+        if metric:
+            query = query.filter(cls.metric == metric)
+        if since:
+            query = query.filter(cls.period >= cls._truncate(since))
+        if until:
+            query = query.filter(cls.period <= until)
+
+        histograms = {}
+        for tag, metric, bucket, count, total in query:
+            histogram = histograms.get((tag, metric))
+            if not histogram:
+                histogram = histograms[(tag, metric)] = {'id': '%s:%s' % (metric, tag),
+                    'tag': tag, 'metric': metric, 'counts': [0] * (len(HISTOGRAM_BUCKETS) + 1),
+                    'count': 0, 'total': 0.0}
+
+            histogram['counts'][bucket] += count
+            histogram['count'] += count
+            histogram['total'] += total
+
+        resources = []
+        for key, histogram in sorted(histograms.iteritems()):
+            counts = histogram.pop('counts')
+            histogram['buckets'] = [{'le': bound, 'count': count}
+                for bound, count in zip(HISTOGRAM_BUCKETS + (None,), counts)]
+            for name, quantile in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+                histogram[name] = cls._estimate_quantile(counts, histogram['count'], quantile)
+            resources.append(histogram)
+        return resources
+
+    @classmethod
+    def flush(cls, session):
+        global observations
+        with guard:
+            pending, observations = observations, {}
+
+        try:
+            for key, (count, total) in sorted(pending.iteritems()):
+                tag, metric, period, bucket = key
+                values = {'tag': tag, 'metric': metric, 'period': period, 'bucket': bucket}
+                if cls._increment(session, values, count, total):
+                    continue
+
+                session.begin_nested()
+                try:
+                    session.add(cls(count=count, total=total, **values))
+                    session.flush()
+                except IntegrityError:
+                    session.rollback()
+                    cls._increment(session, values, count, total)
+                else:
+                    session.commit()
+            session.commit()
+        except Exception:
+            cls._merge(pending)
+            raise
+        return sum(count for count, total in pending.itervalues())
+
+    @classmethod
+    def observe(cls, tag, metric, value, occurrence):
+        key = (tag, metric, cls._truncate(occurrence), bisect_left(HISTOGRAM_BUCKETS, value))
+        cls._merge({key: (1, value)})
+
+    @classmethod
+    def purge(cls, session, lifetime):
+        delta = current_timestamp() - timedelta(days=lifetime)
+        session.query(cls).filter(cls.period < delta).delete(synchronize_session=False)
+
+    @classmethod
+    def _estimate_quantile(cls, counts, total, quantile):
+        if not total:
+            return None
+
+        threshold, cumulative = quantile * total, 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        return None
+
+    @classmethod
+    def _increment(cls, session, values, count, total):
+        return session.query(cls).filter_by(**values).update({'count': cls.count + count,
+            'total': cls.total + total}, synchronize_session=False)
+
+    @classmethod
+    def _merge(cls, pending):
+        with guard:
+            for key, (count, total) in pending.iteritems():
+                entry = observations.get(key)
+                if entry:
+                    count, total = entry[0] + count, entry[1] + total
+                observations[key] = (count, total)
+
+    @classmethod
+    def _truncate(cls, occurrence):
+        return occurrence.replace(minute=0, second=0, microsecond=0)
@@ -0,0 +1,54 @@
+import os
+import socket
+from datetime import timedelta
+
+from scheme import current_timestamp
+from spire.schema import *
+
+__all__ = ('Worker',)
+
+schema = Schema('platoon')
+
+class Worker(Model):
+    """A task queue worker."""
+
+    class meta:
+        schema = schema
+        tablename = 'worker'
+
+    id = Token(nullable=False, primary_key=True)
+    hostname = Text()
+    pid = Integer()
+    started = DateTime(timezone=True)
+    heartbeat = DateTime(timezone=True)
+
+    def __repr__(self):
+        return 'Worker(id=%r)' % self.id
+
+    @classmethod
+    def beat(cls, session, id):
+        session.query(cls).filter_by(id=id).update({'heartbeat': current_timestamp()},
+            synchronize_session=False)
+
+    @classmethod
+    def deregister(cls, session, id):
+        session.query(cls).filter_by(id=id).delete(synchronize_session=False)
+
+    @classmethod
+    def purge(cls, session, lifetime):
+        delta = current_timestamp() - timedelta(days=lifetime)
+        session.query(cls).filter(cls.heartbeat < delta).delete(synchronize_session=False)
+
+    @classmethod
+    def query_dead_workers(cls, session, timeout):
+        threshold = current_timestamp() - timedelta(seconds=timeout)
+        return session.query(cls.id).filter(cls.heartbeat < threshold)
+
+    @classmethod
+    def register(cls, session, id):
+        now = current_timestamp()
+        worker = session.merge(cls(id=id, hostname=socket.gethostname(),
+            pid=os.getpid(), started=now, heartbeat=now))
+
+        session.flush()
+        return worker
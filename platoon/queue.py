@@ -1,64 +1,880 @@
-from datetime import datetime, time
+import os
+import signal
+import socket
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from fnmatch import fnmatchcase
 
-from scheme import current_timestamp
-from spire.core import Component, Dependency
+from scheme import (Boolean, Enumeration, Float, Integer, Sequence, Structure, Text,
+    Token, current_timestamp)
+from spire.core import Component, Configuration, Dependency
 from spire.support.daemon import Daemon
 from spire.support.logs import LogHelper
 from spire.schema import SchemaDependency
 from spire.support.threadpool import ThreadPool
 
+from platoon.constants import IDLE_EXPIRY, SUBSCRIPTION_CHANNEL
 from platoon.idler import Idler
+from platoon.support.dispatcher import HttpDispatcher
+from platoon.support.metrics import MetricsServer, registry as metrics
+from platoon.support.subscriptions import SubscriptionIndex
+from platoon.support.timers import TimerHeap
 
 log = LogHelper('platoon')
 
 class ThreadPackage(object):
-    def __init__(self, session, model, method, **params):
+    def __init__(self, session, model, method, owner=None, **params):
         self.method = method
         self.model = model
+        self.owner = owner
         self.params = params
         self.session = session
+        self.claim = None
+        self.initial = False
 
     def __call__(self):
+        owner = self.owner
+        started = True
+        if owner:
+            started = owner.start_package(self)
+
+        try:
+            if started:
+                self._execute()
+        finally:
+            if owner:
+                owner.finish_package(self)
+
+    def _execute(self):
         session = self.session
         model = session.merge(self.model, load=False)
 
         method = getattr(model, self.method)
         try:
             method(session, **self.params)
+            timers = (self.owner.collect_timers(session) if self.owner else None)
         except Exception:
             session.rollback()
             log('exception', '%s raised uncaught exception', repr(model))
         else:
             session.commit()
+            if timers:
+                self.owner.schedule_timers(timers)
+
+class Lane(object):
+    """An execution lane with its own concurrency limit and queue."""
+
+    def __init__(self, name, concurrency, backlog=0):
+        self.active = 0
+        self.backlog = backlog
+        self.concurrency = concurrency
+        self.name = name
+        self.queue = deque()
+        self.used = time.time()
+
+    def __repr__(self):
+        return 'Lane(name=%r, active=%r, queued=%r)' % (self.name, self.active, len(self.queue))
+
+    def acquire(self, package):
+        self.used = time.time()
+        if self.active < self.concurrency:
+            self.active += 1
+            accepted = True
+        else:
+            self.queue.append(package)
+            accepted = False
+
+        self._update_metrics()
+        return accepted
+
+    def discard_metrics(self):
+        for name in ('platoon_lane_active', 'platoon_lane_queued', 'platoon_lane_saturation',
+                'platoon_lane_deferrals'):
+            metrics.remove(name, lane=self.name)
+
+    def has_room(self, reserved=0):
+        return self.active + len(self.queue) + reserved < self.concurrency + self.backlog
+
+    def is_idle(self, now, expiry):
+        return not (self.active or self.queue) and now - self.used >= expiry
+
+    def release(self):
+        self.active -= 1
+        self.used = time.time()
+        if self.queue:
+            self.active += 1
+            successor = self.queue.popleft()
+        else:
+            successor = None
+
+        self._update_metrics()
+        return successor
+
+    def withdraw(self):
+        packages = list(self.queue)
+        self.queue.clear()
+        self._update_metrics()
+        return packages
+
+    def _update_metrics(self):
+        labels = {'lane': self.name}
+        metrics.gauge('platoon_lane_active',
+            'Number of packages executing in each lane.').set(self.active, **labels)
+        metrics.gauge('platoon_lane_queued',
+            'Number of packages waiting for a slot in each lane.').set(len(self.queue), **labels)
+        metrics.gauge('platoon_lane_saturation',
+            'Fraction of the concurrency of each lane currently in use.').set(
+            float(self.active) / self.concurrency, **labels)
+
+class Limit(object):
+    """A limit on the in-flight requests and request rate of a destination."""
+
+    def __init__(self, name, concurrency=None, rate=None, burst=1):
+        self.active = 0
+        self.burst = burst
+        self.concurrency = concurrency
+        self.name = name
+        self.rate = rate
+        self.tokens = float(burst)
+        self.updated = self.used = time.time()
+
+    def __repr__(self):
+        return 'Limit(name=%r, active=%r)' % (self.name, self.active)
+
+    def acquire(self):
+        self.active += 1
+        self.used = time.time()
+        if self.rate:
+            self.tokens -= 1
+        self._update_metrics()
+
+    def calculate_delay(self):
+        if self.rate and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+
+    def discard_metrics(self):
+        for name in ('platoon_limit_active', 'platoon_limit_deferrals'):
+            metrics.remove(name, limit=self.name)
+
+    def is_idle(self, now, expiry):
+        if self.active or now - self.used < expiry:
+            return False
+        return not self.rate or self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def is_available(self, now):
+        if self.concurrency and self.active >= self.concurrency:
+            return False
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+            self.updated = now
+            return self.tokens >= 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self.used = time.time()
+        self._update_metrics()
+
+    def _update_metrics(self):
+        metrics.gauge('platoon_limit_active',
+            'Number of tasks in flight against each destination limit.').set(
+            self.active, limit=self.name)
+
+class Claim(object):
+    """The execution resources held by a claimed task until it finishes."""
+
+    def __init__(self, id, lane=None, limits=()):
+        self.claimed = time.time()
+        self.id = id
+        self.lane = lane
+        self.limits = limits
+        self.started = False
+
+    def __repr__(self):
+        return 'Claim(id=%r, lane=%r)' % (self.id, self.lane)
+
+class Admission(object):
+    """Admits claimed tasks into execution lanes and destination limits during a
+    single claim cycle."""
+
+    def __init__(self, taskqueue):
+        configuration = taskqueue.configuration
+        self.claims = {}
+        self.deferred = 0
+        self.delay = None
+        self.reserved = {}
+        self.selective = bool(configuration['lanes'] or configuration['limits'])
+        self.taskqueue = taskqueue
+
+    def __call__(self, task):
+        taskqueue = self.taskqueue
+        lane = taskqueue.select_lane(task.action)
+        limits = taskqueue.select_limits(task)
+        if not (lane or limits):
+            self.claims[task.id] = Claim(task.id)
+            return True
+
+        now = time.time()
+        with taskqueue.guard:
+            reserved = (self.reserved.get(lane.name, 0) if lane else 0)
+            if lane and not lane.has_room(reserved):
+                return self._defer('platoon_lane_deferrals',
+                    'Number of due tasks left pending because their lane was full.',
+                    lane=lane.name)
+
+            blocked = [limit for limit in limits if not limit.is_available(now)]
+            if blocked:
+                for limit in blocked:
+                    delay = limit.calculate_delay()
+                    if delay is not None and (self.delay is None or delay < self.delay):
+                        self.delay = delay
+                return self._defer('platoon_limit_deferrals',
+                    'Number of due tasks left pending because of a destination limit.',
+                    limit=blocked[0].name)
+
+            for limit in limits:
+                limit.acquire()
+
+        if lane:
+            self.reserved[lane.name] = reserved + 1
+        self.claims[task.id] = Claim(task.id, lane, limits)
+        return True
+
+    def cancel(self):
+        with self.taskqueue.guard:
+            for claim in self.claims.itervalues():
+                for limit in claim.limits:
+                    limit.release()
+            self.claims = {}
+
+    def claim(self, id):
+        return self.claims.get(id) or Claim(id)
+
+    def _defer(self, name, description, **labels):
+        self.deferred += 1
+        metrics.counter(name, description).inc(**labels)
+        return False
 
 class TaskQueue(Component, Daemon):
     """An asynchronous task queue."""
 
+    configuration = Configuration({
+        'drain_signal': Enumeration('SIGINT SIGTERM SIGUSR1 SIGUSR2'),
+        'drain_timeout': Integer(nonnull=True, minimum=0, default=30),
+        'claim_limit': Integer(nonnull=True, minimum=1, default=500),
+        'claim_mode': Enumeration('lock skip-locked', nonnull=True, default='lock'),
+        'engine': Enumeration('threaded evented', nonnull=True, default='threaded'),
+        'execution_limit': Integer(nonnull=True, minimum=1, default=3600),
+        'histogram_interval': Integer(nonnull=True, minimum=1, default=60),
+        'horizon_interval': Integer(nonnull=True, minimum=1, default=60),
+        'lanes': Sequence(Structure({
+            'name': Token(nonempty=True),
+            'types': Sequence(Enumeration('http-request internal process test')),
+            'hosts': Sequence(Text(nonempty=True)),
+            'concurrency': Integer(nonnull=True, minimum=1, default=1),
+            'backlog': Integer(nonnull=True, minimum=0, default=0),
+            'partition': Boolean(nonnull=True, default=False),
+        }), nonnull=True, default=[]),
+        'limits': Sequence(Structure({
+            'host': Text(nonempty=True),
+            'tag': Text(nonempty=True),
+            'concurrency': Integer(minimum=1),
+            'rate': Float(minimum=0),
+            'burst': Integer(nonnull=True, minimum=1, default=1),
+        }), nonnull=True, default=[]),
+        'lease_duration': Integer(nonnull=True, minimum=3, default=60),
+        'metrics_address': Text(nonnull=True, default='127.0.0.1'),
+        'metrics_port': Integer(minimum=0),
+        'prefetch': Integer(nonnull=True, minimum=0, default=5),
+        'request_limit': Integer(nonnull=True, minimum=1, default=1000),
+        'subscription_index': Boolean(nonnull=True, default=False),
+        'subscription_refresh': Integer(nonnull=True, minimum=1, default=300),
+        'worker': Token(),
+        'worker_timeout': Integer(nonnull=True, minimum=1, default=300),
+    })
+
     idler = Dependency(Idler)
     schema = SchemaDependency('platoon')
     threads = Dependency(ThreadPool)
 
-    def enqueue(self, model, method, **params):
-        session = self.schema.get_session(True)
-        self.threads.enqueue(ThreadPackage(session, model, method, **params))
+    dispatcher = None
+    active = 0
+    deferred = 0
+    delay = None
+    draining = None
+    expired = 0
+    flushed = 0
+    inflight = 0
+    listener = None
+    maintained = 0
+    materialized = 0
+    outstanding = 0
+    queued = 0
+    refreshed = 0
+    saturated = False
+    subscriptions = None
+    wakeup = None
+
+    def __init__(self):
+        self.claims = {}
+        self.current = threading.local()
+        self.guard = threading.Lock()
+        self.lanes = {}
+        self.limits = {}
+        self.timers = TimerHeap()
+        self.unstarted = []
+
+    @property
+    def capacity(self):
+        return self.threads.configuration['maximum_threads']
+
+    def admit(self):
+        return Admission(self)
+
+    def calculate_claim_limit(self):
+        with self.guard:
+            available = self._calculate_available()
+
+        limit = max(min(available, self.configuration['claim_limit']), 0)
+        metrics.gauge('platoon_claim_batch_size',
+            'Maximum number of tasks claimed in the current cycle.').set(limit)
+        return limit
+
+    def collect_timers(self, session):
+        from platoon.models import ScheduledTask
+
+        candidates = [instance for instance in list(session.new) + list(session.dirty)
+            if isinstance(instance, ScheduledTask)]
+        if not candidates:
+            return
+
+        session.flush()
+        horizon = current_timestamp() + timedelta(seconds=self._calculate_maximum_timeout())
+        return [(task.id, task.occurrence) for task in candidates
+            if task.status in ('pending', 'retrying') and task.occurrence <= horizon]
+
+    def dispatch(self, model, request, method, **params):
+        package = getattr(self.current, 'package', None)
+        claim = None
+        if package:
+            claim, package.claim = package.claim, None
+
+        def callback(response, error):
+            try:
+                self.enqueue(model, method, claim, True, response=response,
+                    error=error, **params)
+            finally:
+                self._finish_request()
+
+        with self.guard:
+            self.inflight += 1
+            self.outstanding += 1
+
+        try:
+            self.dispatcher.submit(request, callback)
+        except Exception:
+            if package:
+                package.claim = claim
+            self._finish_request()
+            raise
+
+    def drain(self, *args):
+        if not self.draining:
+            log('info', 'draining task queue')
+            self.draining = time.time()
+            self.idler.interrupt()
+
+    def enqueue(self, model, method, claim=None, held=False, **params):
+        package = ThreadPackage(self.schema.get_session(True), model, method, self, **params)
+        package.claim = claim
+        package.initial = bool(claim and not held)
+
+        with self.guard:
+            self.outstanding += 1
+            accepted = True
+            if claim and not held:
+                self.claims[claim.id] = claim
+                if claim.lane:
+                    accepted = claim.lane.acquire(package)
+            if accepted:
+                self.queued += 1
+            self._update_backlog()
+
+        if accepted:
+            self.threads.enqueue(package)
+
+    def finish_package(self, package):
+        successor = None
+        with self.guard:
+            self.active -= 1
+            self.outstanding -= 1
+            claim = package.claim
+            if claim:
+                self.claims.pop(claim.id, None)
+                if claim.lane:
+                    successor = claim.lane.release()
+                for limit in claim.limits:
+                    limit.release()
+            if successor:
+                self.queued += 1
+            self._update_backlog()
+            saturated, self.saturated = self.saturated, False
+
+        self.current.package = None
+        if successor:
+            self.threads.enqueue(successor)
+        if saturated or (self.deferred and claim and (claim.lane or claim.limits)):
+            self.idler.interrupt()
+
+    def schedule_timers(self, timers):
+        earliest = None
+        for identifier, occurrence in timers:
+            if self.timers.add(identifier, occurrence):
+                earliest = occurrence
+
+        metrics.gauge('platoon_timers',
+            'Number of near-term tasks held in the timer heap.').set(len(self.timers))
+        wakeup = self.wakeup
+        if earliest and (wakeup is None or earliest < wakeup):
+            self.idler.interrupt()
+
+    def select_lane(self, action):
+        type, host = action.type, False
+        for candidate in self.configuration['lanes']:
+            if candidate.get('types') and type not in candidate['types']:
+                continue
+            if host is False and (candidate.get('hosts') or candidate['partition']):
+                host = action.host
+            if candidate.get('hosts') and host not in candidate['hosts']:
+                continue
+
+            name = candidate['name']
+            if candidate['partition']:
+                name = '%s:%s' % (name, host or '')
+
+            with self.guard:
+                lane = self.lanes.get(name)
+                if not lane:
+                    lane = self.lanes[name] = Lane(name, candidate['concurrency'],
+                        candidate['backlog'])
+            return lane
+
+    def select_limits(self, task):
+        limits, host = [], False
+        for index, candidate in enumerate(self.configuration['limits']):
+            if candidate.get('host'):
+                if host is False:
+                    host = task.action.host
+                pattern, value = candidate['host'], host
+            elif candidate.get('tag'):
+                pattern, value = candidate['tag'], task.tag
+            else:
+                continue
+
+            if value is None or not fnmatchcase(value, pattern):
+                continue
+
+            key = (index, value)
+            with self.guard:
+                limit = self.limits.get(key)
+                if not limit:
+                    limit = self.limits[key] = Limit(value, candidate.get('concurrency'),
+                        candidate.get('rate'), candidate['burst'])
+            limits.append(limit)
+        return limits
+
+    def start_package(self, package):
+        self.current.package = package
+        with self.guard:
+            self.active += 1
+            self.queued -= 1
+            self._update_backlog()
+            if package.initial:
+                if self.draining:
+                    self.unstarted.append(package.claim.id)
+                    return False
+                package.claim.started = True
+        return True
+
+    @property
+    def worker_id(self):
+        return self.configuration.get('worker') or '%s:%d' % (socket.gethostname(),
+            os.getpid())
 
     def run(self):
-        from platoon.models import Event, Process, ScheduledTask
+        from platoon.models import Event, Process, ScheduledTask, Worker
 
         idler = self.idler
         schema = self.schema
         session = schema.session
         threads = self.threads
 
-        ScheduledTask.retry_executing_tasks(session)
+        if self.configuration['engine'] == 'evented':
+            self.dispatcher = HttpDispatcher()
+            self.dispatcher.start()
+
+        port = self.configuration.get('metrics_port')
+        if port is not None:
+            MetricsServer(self.configuration['metrics_address'], port, metrics).start()
+
+        self._install_drain_handler()
+
+        worker_id = self.worker_id
+        Worker.register(session, worker_id)
+        session.commit()
+
+        ScheduledTask.retry_executing_tasks(session, worker_id,
+            self.configuration['worker_timeout'])
+
+        if self.configuration['subscription_index']:
+            self.subscriptions = SubscriptionIndex()
+
+        now = current_timestamp()
+        self.schedule_timers(ScheduledTask.query_near_term_tasks(session, now,
+            now + timedelta(seconds=self._calculate_maximum_timeout()),
+            self.configuration['claim_limit']))
+        session.close()
+
         try:
-            while True:
-                idler.idle()
+            timeout = 0
+            while not self.draining:
+                self.wakeup = current_timestamp() + timedelta(seconds=timeout)
+                idler.idle(timeout)
+                self.wakeup = None
+                if self.draining:
+                    break
+
                 try:
-                    Event.process_events(session)
+                    started = time.time()
+                    Worker.beat(session, worker_id)
+                    session.commit()
+
+                    self._maintain_leases(session)
+                    self._maintain_horizons(session)
+                    self._maintain_histograms(session)
+                    self._expire_idle_entries()
+                    started = self._measure_phase('maintenance', started)
+
+                    self._maintain_subscriptions(session)
+                    Event.process_events(session, synchronize=self._synchronize_subscriptions)
+                    started = self._measure_phase('events', started)
+
                     Process.process_processes(self, session)
+                    started = self._measure_phase('processes', started)
+
                     ScheduledTask.process_tasks(self, session)
+                    self.timers.expire(current_timestamp())
+                    started = self._measure_phase('tasks', started)
+
+                    timeout = self._calculate_timeout(session)
+                    self._measure_phase('timeout', started)
                 finally:
                     session.close()
+
+            self._complete_drain(session)
         except Exception:
             log('exception', 'exception raised by task queue')
+
+    def _calculate_available(self):
+        configuration = self.configuration
+        available = (self.capacity + configuration['prefetch']
+            - (self.outstanding - self.inflight))
+        if self.dispatcher:
+            available = min(available, configuration['request_limit'] - self.inflight)
+        return available
+
+    def _calculate_timeout(self, session):
+        from platoon.models import Event, Process, ScheduledTask
+
+        maximum = self._calculate_maximum_timeout()
+        if Event.has_pending_events(session):
+            return 0
+
+        now = current_timestamp()
+        occurrence = ScheduledTask.next_occurrence(session, (now if self.deferred else None))
+        timer = self.timers.next()
+        if timer and (occurrence is None or timer < occurrence):
+            occurrence = timer
+
+        if occurrence and occurrence <= current_timestamp() and self._is_saturated():
+            occurrence = None
+
+        deadlines = [deadline for deadline in (occurrence, Process.next_deadline(session))
+            if deadline is not None]
+        if self.delay is not None:
+            deadlines.append(current_timestamp() + timedelta(seconds=self.delay))
+        if not deadlines:
+            return maximum
+
+        timeout = (min(deadlines) - current_timestamp()).total_seconds()
+        return min(max(timeout, 0), maximum)
+
+    def _calculate_maximum_timeout(self):
+        configuration = self.configuration
+        return min(self.idler.configuration['timeout'], configuration['worker_timeout'] / 2,
+            configuration['lease_duration'] / 3)
+
+    def _close_listener(self):
+        listener, self.listener = self.listener, None
+        if listener:
+            try:
+                listener.close()
+            except Exception:
+                log('exception', 'unable to close subscription listener')
+
+    def _complete_drain(self, session):
+        from platoon.models import ScheduledTask, TaskHistogram, Worker
+
+        withdrawn = []
+        with self.guard:
+            for lane in self.lanes.itervalues():
+                withdrawn.extend(lane.withdraw())
+
+            for package in withdrawn:
+                claim = package.claim
+                self.claims.pop(claim.id, None)
+                for limit in claim.limits:
+                    limit.release()
+                self.outstanding -= 1
+            self._update_backlog()
+
+        for package in withdrawn:
+            package.session.close()
+        if withdrawn:
+            ScheduledTask.release_tasks(session, self.worker_id,
+                [package.claim.id for package in withdrawn])
+            session.commit()
+
+        deadline = self.draining + self.configuration['drain_timeout']
+        while time.time() < deadline:
+            with self.guard:
+                if self.outstanding <= 0:
+                    break
+
+            try:
+                self._renew_leases(session)
+            except Exception:
+                session.rollback()
+                log('exception', 'failed to renew leases while draining')
+            time.sleep(0.1)
+
+        with self.guard:
+            unstarted = set(self.unstarted)
+            unstarted.update(claim.id for claim in self.claims.itervalues()
+                if not claim.started)
+            self.unstarted = []
+            remaining = self.outstanding
+
+        if unstarted:
+            ScheduledTask.release_tasks(session, self.worker_id, list(unstarted))
+            session.commit()
+        if self.dispatcher:
+            self.dispatcher.stop()
+        self._close_listener()
+
+        try:
+            TaskHistogram.flush(session)
+        except Exception:
+            session.rollback()
+            log('exception', 'failed to flush task histograms while draining')
+
+        if remaining <= 0:
+            Worker.deregister(session, self.worker_id)
+            session.commit()
+
+        log('info', 'drained task queue, returning %d unstarted tasks to pending'
+            ' with %d packages still outstanding', len(withdrawn) + len(unstarted), remaining)
+
+    def _expire_idle_entries(self):
+        now = time.time()
+        if now - self.expired < IDLE_EXPIRY:
+            return
+
+        self.expired = now
+        with self.guard:
+            for entries in (self.lanes, self.limits):
+                expired = []
+                for key, entry in entries.items():
+                    if entry.is_idle(now, IDLE_EXPIRY):
+                        expired.append(entries.pop(key))
+
+                names = set(entry.name for entry in entries.itervalues())
+                for entry in expired:
+                    if entry.name not in names:
+                        entry.discard_metrics()
+
+    def _finish_request(self):
+        with self.guard:
+            self.inflight -= 1
+            self.outstanding -= 1
+            self._update_backlog()
+            saturated, self.saturated = self.saturated, False
+
+        if saturated:
+            self.idler.interrupt()
+
+    def _is_saturated(self):
+        with self.guard:
+            self.saturated = (self._calculate_available() <= 0)
+            return self.saturated
+
+    def _install_drain_handler(self):
+        name = self.configuration.get('drain_signal')
+        if not name:
+            return
+
+        try:
+            signal.signal(getattr(signal, name), self.drain)
+        except ValueError:
+            log('warning', 'unable to install drain handler for %s', name)
+
+    def _maintain_histograms(self, session):
+        from platoon.models import TaskHistogram
+
+        now = time.time()
+        if now - self.flushed < self.configuration['histogram_interval']:
+            return
+
+        self.flushed = now
+        flushed = TaskHistogram.flush(session)
+        if flushed:
+            metrics.counter('platoon_histogram_observations',
+                'Number of task timing observations flushed to histograms.').inc(flushed)
+
+    def _maintain_horizons(self, session):
+        from platoon.models import RecurringTask
+
+        configuration, now = self.configuration, time.time()
+        if now - self.materialized < configuration['horizon_interval']:
+            return
+
+        self.materialized = now
+        materialized = RecurringTask.replenish_horizons(session, configuration['claim_limit'],
+            configuration['claim_mode'] == 'skip-locked')
+        if materialized:
+            metrics.counter('platoon_materialized_tasks',
+                'Number of scheduled tasks materialized ahead of time for recurring tasks.').inc(
+                materialized)
+        session.commit()
+
+    def _maintain_leases(self, session):
+        from platoon.models import ScheduledTask
+
+        if not self._renew_leases(session):
+            return
+
+        configuration = self.configuration
+        recovered = ScheduledTask.recover_expired_leases(session, configuration['claim_limit'],
+            configuration['claim_mode'] == 'skip-locked')
+        if recovered:
+            metrics.counter('platoon_expired_leases',
+                'Number of executing tasks recovered after their lease expired.').inc(recovered)
+        session.commit()
+
+    def _maintain_subscriptions(self, session):
+        from platoon.models import SubscribedTask
+
+        index = self.subscriptions
+        if index is None:
+            return
+
+        if not self.listener:
+            try:
+                self.listener = self._listen(session, SUBSCRIPTION_CHANNEL)
+            except Exception:
+                log('exception', 'unable to listen for subscription changes')
+                return
+
+        now = time.time()
+        if now - self.refreshed < self.configuration['subscription_refresh']:
+            return
+
+        if self._poll_subscriptions() is None:
+            return
+
+        SubscribedTask.index_subscriptions(session, index)
+        self.refreshed = now
+        session.commit()
+
+        metrics.gauge('platoon_subscription_index_size',
+            'Number of subscriptions held in the in-memory subscription index.').set(len(index))
+
+    def _listen(self, session, channel):
+        connection = session.get_bind().raw_connection()
+        connection.detach()
+
+        listener = connection.connection
+        try:
+            listener.autocommit = True
+            cursor = listener.cursor()
+            cursor.execute('listen %s' % channel)
+            cursor.close()
+        except Exception:
+            listener.close()
+            raise
+
+        self.refreshed = 0
+        return listener
+
+    def _poll_subscriptions(self):
+        try:
+            cursor = self.listener.cursor()
+            cursor.execute('select 1')
+            cursor.close()
+            identifiers = set(notify.payload for notify in self.listener.notifies)
+            del self.listener.notifies[:]
+        except Exception:
+            log('exception', 'lost subscription change notifications')
+            self._close_listener()
+        else:
+            return identifiers
+
+    def _measure_phase(self, phase, started):
+        now = time.time()
+        metrics.histogram('platoon_loop_phase_seconds',
+            'Duration of each phase of the task queue loop.').observe(now - started, phase=phase)
+        return now
+
+    def _renew_leases(self, session):
+        from platoon.models import ScheduledTask
+
+        configuration, now = self.configuration, time.time()
+        if now - self.maintained < configuration['lease_duration'] / 3:
+            return False
+
+        self.maintained = now
+        threshold = now - configuration['execution_limit']
+        with self.guard:
+            identifiers = [claim.id for claim in self.claims.itervalues()
+                if claim.claimed > threshold]
+
+        if identifiers:
+            ScheduledTask.renew_leases(session, self.worker_id, identifiers,
+                configuration['lease_duration'])
+            session.commit()
+        return True
+
+    def _synchronize_subscriptions(self, session):
+        from platoon.models import SubscribedTask
+
+        index = self.subscriptions
+        if index is None or not self.listener:
+            return None
+
+        identifiers = self._poll_subscriptions()
+        if identifiers is None:
+            return None
+
+        if identifiers:
+            SubscribedTask.index_subscriptions(session, index, identifiers)
+        return index
+
+    def _update_backlog(self):
+        metrics.gauge('platoon_task_backlog',
+            'Number of claimed tasks waiting for a worker thread.').set(
+            self.outstanding - self.active - self.inflight)
+        metrics.gauge('platoon_threadpool_queue_depth',
+            'Number of packages queued on the thread pool but not yet started.').set(
+            self.queued)
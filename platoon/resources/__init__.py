@@ -6,3 +6,4 @@ from .recurringtask import *
 from .schedule import *
 from .scheduledtask import *
 from .subscribedtask import *
+from .taskhistogram import *
@@ -15,3 +15,4 @@ class RecurringTask(Task):
     class schema:
         status = Enumeration('active inactive', nonnull=True, default='active')
         schedule_id = UUID(nonempty=True, operators='equal')
+        horizon = Integer(minimum=1, maximum=1000)
@@ -56,3 +56,20 @@ class Schedule(Resource):
 
     class update(Resource.update):
         support_returning = True
+
+    class occurrences:
+        endpoint = ('OCCURRENCES', 'schedule/id')
+        specific = True
+        title = 'Previewing the occurrences of a schedule'
+        schema = Structure({
+            'start': DateTime(utc=True),
+            'end': DateTime(utc=True),
+            'limit': Integer(minimum=1, maximum=10000, default=100),
+        })
+        responses = {
+            OK: Response(Structure({
+                'id': UUID(nonempty=True),
+                'occurrences': Sequence(DateTime(utc=True)),
+            })),
+            INVALID: Response(Errors),
+        }
@@ -17,6 +17,7 @@ class ScheduledTask(Task):
         occurrence = DateTime(nonnull=True, utc=True)
         executions = Sequence(Structure({
             'attempt': Integer(),
+            'due': DateTime(utc=True),
             'status': Enumeration('completed failed'),
             'started': DateTime(utc=True),
             'completed': DateTime(utc=True),
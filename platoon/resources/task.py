@@ -12,6 +12,7 @@ TaskStructure = Structure(
             'headers': Map(Text(nonempty=True)),
             'timeout': Integer(nonnull=True, default=30),
             'injections': Sequence(Text(nonempty=True)),
+            'capture': Enumeration('body headers'),
         },
         'internal': {
             'purpose': Enumeration('purge', nonempty=True),
@@ -38,6 +39,7 @@ class Task(Resource):
         retry_backoff = Float()
         retry_limit = Integer(nonnull=True, default=2)
         retry_timeout = Integer(nonnull=True, default=300)
+        priority = Integer(nonnull=True, default=DEFAULT_PRIORITY)
         task = TaskStructure.clone(required=True)
         completed = TaskStructure.clone()
         failed = TaskStructure.clone()
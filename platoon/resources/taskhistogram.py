@@ -0,0 +1,31 @@
+from mesh.standard import *
+from scheme import *
+
+__all__ = ('TaskHistogram',)
+
+class TaskHistogram(Resource):
+    """A rolling histogram of task timings for a tag."""
+
+    name = 'taskhistogram'
+    version = 1
+    requests = 'query'
+
+    class schema:
+        id = Text(readonly=True)
+        tag = Text(operators='equal')
+        metric = Enumeration('lag latency', operators='equal')
+        count = Integer(readonly=True)
+        total = Float(readonly=True)
+        p50 = Float(readonly=True)
+        p90 = Float(readonly=True)
+        p99 = Float(readonly=True)
+        buckets = Sequence(Structure({
+            'le': Float(),
+            'count': Integer(),
+        }), readonly=True)
+
+    class query(Resource.query):
+        fields = {
+            'since': DateTime(utc=True),
+            'until': DateTime(utc=True),
+        }
@@ -0,0 +1,359 @@
+import errno
+import fcntl
+import heapq
+import os
+import select
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from cStringIO import StringIO
+from httplib import HTTPResponse
+
+from spire.support.logs import LogHelper
+
+from platoon.support.metrics import registry as metrics
+
+__all__ = ('HttpDispatcher',)
+
+log = LogHelper('platoon')
+
+HEADER_ALLOWANCE = 65536
+SSL_CLOSED = (ssl.SSL_ERROR_EOF, ssl.SSL_ERROR_ZERO_RETURN)
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+if hasattr(select, 'epoll'):
+
+    class Poller(object):
+        READ = select.EPOLLIN | select.EPOLLPRI
+        WRITE = select.EPOLLOUT
+
+        def __init__(self):
+            self.poller = select.epoll()
+
+        def modify(self, fd, interest):
+            self.poller.modify(fd, interest)
+
+        def poll(self, timeout):
+            return self.poller.poll(timeout)
+
+        def register(self, fd, interest):
+            self.poller.register(fd, interest)
+
+        def unregister(self, fd):
+            self.poller.unregister(fd)
+
+else:
+
+    class Poller(object):
+        READ = select.POLLIN | select.POLLPRI
+        WRITE = select.POLLOUT
+
+        def __init__(self):
+            self.poller = select.poll()
+
+        def modify(self, fd, interest):
+            self.poller.modify(fd, interest)
+
+        def poll(self, timeout):
+            return self.poller.poll(timeout * 1000)
+
+        def register(self, fd, interest):
+            self.poller.register(fd, interest)
+
+        def unregister(self, fd):
+            self.poller.unregister(fd)
+
+class ResponseSource(object):
+    def __init__(self, content):
+        self.content = content
+
+    def makefile(self, *args, **params):
+        return StringIO(self.content)
+
+class Channel(object):
+    """An outstanding http request on a non-blocking socket."""
+
+    def __init__(self, request, callback, deadline):
+        self.callback = callback
+        self.chunks = []
+        self.clipped = False
+        self.deadline = deadline
+        self.finished = False
+        self.request = request
+        self.socket = None
+        self.state = 'connecting'
+
+        host, port = request.address
+        self.address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+        self.outgoing = self._serialize_request(request)
+        self.received = 0
+
+    def close(self):
+        self.finished = True
+        if self.socket:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+
+    def handle(self, poller):
+        try:
+            return self._advance(poller)
+        except ssl.SSLError, exception:
+            if exception.args[0] == ssl.SSL_ERROR_WANT_READ:
+                return poller.READ
+            elif exception.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                return poller.WRITE
+            elif self.state == 'receiving' and self._is_closure(exception):
+                return self._advance_on_close()
+            raise
+        except socket.error, exception:
+            if exception.args[0] in WOULD_BLOCK:
+                return (poller.READ if self.state == 'receiving' else poller.WRITE)
+            raise
+
+    def open(self, poller):
+        family, socktype, protocol, name, address = self.address
+        self.socket = socket.socket(family, socktype, protocol)
+        self.socket.setblocking(0)
+
+        error = self.socket.connect_ex(address)
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise socket.error(error, os.strerror(error))
+
+        return self.socket.fileno(), poller.WRITE
+
+    def parse_response(self):
+        response = HTTPResponse(ResponseSource(''.join(self.chunks)),
+            method=self.request.method)
+
+        response.begin()
+        return self.request.construct_response(response, self.clipped)
+
+    def _advance(self, poller):
+        if self.state == 'connecting':
+            error = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise socket.error(error, os.strerror(error))
+
+            if self.request.scheme == 'https':
+                self.socket = self._wrap_socket(self.socket)
+                self.state = 'handshaking'
+            else:
+                self.state = 'sending'
+
+        if self.state == 'handshaking':
+            self.socket.do_handshake()
+            self.state = 'sending'
+
+        if self.state == 'sending':
+            while self.outgoing:
+                sent = self.socket.send(self.outgoing)
+                self.outgoing = self.outgoing[sent:]
+            self.state = 'receiving'
+
+        while True:
+            data = self.socket.recv(65536)
+            if not data:
+                return self._advance_on_close()
+
+            self.chunks.append(data)
+            self.received += len(data)
+            if self._is_sufficient(data):
+                self.clipped = True
+                return self._advance_on_close()
+
+    def _advance_on_close(self):
+        self.state = 'received'
+
+    def _is_closure(self, exception):
+        return exception.args[0] in SSL_CLOSED or 'eof' in str(exception).lower()
+
+    def _is_sufficient(self, data):
+        request = self.request
+        if request.headers_only:
+            return '\r\n\r\n' in ''.join(self.chunks[-2:])
+        elif request.limit is not None:
+            return self.received > request.limit + HEADER_ALLOWANCE
+        else:
+            return False
+
+    def _serialize_request(self, request):
+        body = request.body
+        if isinstance(body, unicode):
+            body = body.encode('utf8')
+
+        lines = ['%s %s HTTP/1.1' % (request.method, request.path or '/'),
+            'Host: %s' % request.host, 'Connection: close', 'Accept-Encoding: identity']
+
+        for header, value in sorted(request.headers.iteritems()):
+            if header.lower() not in ('host', 'connection', 'content-length'):
+                lines.append('%s: %s' % (header, value))
+
+        if body is not None or request.method in ('POST', 'PUT'):
+            lines.append('Content-Length: %d' % len(body or ''))
+
+        return '\r\n'.join(lines) + '\r\n\r\n' + (body or '')
+
+    def _wrap_socket(self, sock):
+        host = self.request.address[0]
+        if hasattr(ssl, '_create_default_https_context'):
+            context = ssl._create_default_https_context()
+            return context.wrap_socket(sock, server_hostname=host,
+                do_handshake_on_connect=False)
+        else:
+            return ssl.wrap_socket(sock, do_handshake_on_connect=False)
+
+class HttpDispatcher(object):
+    """An evented http dispatcher.
+
+    Drives any number of outstanding http requests from a single thread using
+    non-blocking sockets. Callbacks are invoked on the dispatcher thread with
+    either a response or an exception, and should hand any further work off
+    to another thread as quickly as possible.
+    """
+
+    def __init__(self, timeout=300):
+        self.channels = {}
+        self.deadlines = []
+        self.guard = threading.Lock()
+        self.incoming = deque()
+        self.poller = Poller()
+        self.running = False
+        self.thread = None
+        self.timeout = timeout
+
+        self.wakee, self.waker = os.pipe()
+        for fd in (self.waker, self.wakee):
+            self._set_nonblocking(fd)
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='platoon-http-dispatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wake()
+
+    def submit(self, request, callback):
+        deadline = time.time() + (request.timeout or self.timeout)
+        channel = Channel(request, callback, deadline)
+
+        with self.guard:
+            self.incoming.append(channel)
+        self._wake()
+
+    def _accept_channels(self):
+        while True:
+            with self.guard:
+                if not self.incoming:
+                    break
+                channel = self.incoming.popleft()
+
+            try:
+                fd, interest = channel.open(self.poller)
+            except Exception, exception:
+                self._finish(channel, None, exception)
+            else:
+                self.channels[fd] = channel
+                self.poller.register(fd, interest)
+                heapq.heappush(self.deadlines, (channel.deadline, fd, channel))
+
+        metrics.gauge('platoon_http_inflight',
+            'Number of http requests outstanding on the evented dispatcher.').set(
+            len(self.channels))
+
+    def _calculate_timeout(self):
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][2].finished:
+            heapq.heappop(deadlines)
+
+        if deadlines:
+            return max(deadlines[0][0] - time.time(), 0)
+        else:
+            return self.timeout
+
+    def _expire_channels(self):
+        deadlines, now = self.deadlines, time.time()
+        while deadlines and deadlines[0][0] <= now:
+            deadline, fd, channel = heapq.heappop(deadlines)
+            if not channel.finished:
+                self._finish(channel, None, socket.timeout('timed out'), fd)
+
+    def _finish(self, channel, response, exception, fd=None):
+        if fd is not None:
+            self.channels.pop(fd, None)
+            try:
+                self.poller.unregister(fd)
+            except (IOError, OSError, ValueError):
+                pass
+
+        channel.close()
+        try:
+            channel.callback(response, exception)
+        except Exception:
+            log('exception', 'callback for %s raised uncaught exception', channel.request.url)
+
+    def _handle(self, fd, channel):
+        try:
+            interest = channel.handle(self.poller)
+            if interest is None:
+                response = channel.parse_response()
+        except Exception, exception:
+            self._finish(channel, None, exception, fd)
+        else:
+            if interest is None:
+                self._finish(channel, response, None, fd)
+            else:
+                self.poller.modify(fd, interest)
+
+    def _run(self):
+        self.poller.register(self.wakee, self.poller.READ)
+        while self.running:
+            self._accept_channels()
+            try:
+                events = self.poller.poll(self._calculate_timeout())
+            except (IOError, OSError, select.error), exception:
+                if exception.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                if fd == self.wakee:
+                    self._drain_waker()
+                    continue
+
+                channel = self.channels.get(fd)
+                if channel:
+                    self._handle(fd, channel)
+
+            self._expire_channels()
+
+        for fd, channel in self.channels.items():
+            self._finish(channel, None, socket.error('dispatcher stopped'), fd)
+
+    def _drain_waker(self):
+        try:
+            while os.read(self.wakee, 4096):
+                pass
+        except OSError, exception:
+            if exception.args[0] not in WOULD_BLOCK:
+                raise
+
+    def _set_nonblocking(self, fd):
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def _wake(self):
+        try:
+            os.write(self.waker, '\x00')
+        except OSError, exception:
+            if exception.args[0] not in WOULD_BLOCK:
+                raise
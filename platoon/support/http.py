@@ -1,17 +1,121 @@
+import hashlib
+import select
 import socket
-from httplib import HTTPConnection, HTTPSConnection
+import threading
+import time
+from httplib import HTTPConnection, HTTPException, HTTPSConnection, IncompleteRead
 from urlparse import urlparse
 
 from scheme import formats
 from mesh.exceptions import *
 
+from platoon.support.metrics import registry as metrics
+
+CHUNK_SIZE = 65536
+IDEMPOTENT_METHODS = ('DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT')
+
+class ConnectionPool(object):
+    """A thread-safe pool of persistent http connections, keyed by scheme,
+    host and port."""
+
+    def __init__(self, maximum=10, lifetime=60):
+        self.evicted = time.time()
+        self.guard = threading.Lock()
+        self.idle = {}
+        self.lifetime = lifetime
+        self.maximum = maximum
+
+    def acquire(self, scheme, host, port, timeout=None):
+        key, now = (scheme, host, port), time.time()
+        with self.guard:
+            candidates = self.idle.get(key)
+            while candidates:
+                connection, released = candidates.pop()
+                if now - released > self.lifetime or self._is_stale(connection):
+                    connection.close()
+                    continue
+
+                connection.timeout = timeout
+                connection.sock.settimeout(timeout)
+                metrics.counter('platoon_http_pool_hits',
+                    'Number of http requests which reused a pooled connection.').inc()
+                return connection, True
+
+        metrics.counter('platoon_http_pool_misses',
+            'Number of http requests which opened a new connection.').inc()
+        return self.connect(scheme, host, port, timeout), False
+
+    def connect(self, scheme, host, port, timeout=None):
+        if scheme == 'https':
+            return HTTPSConnection(host=host, port=port, timeout=timeout)
+        else:
+            return HTTPConnection(host=host, port=port, timeout=timeout)
+
+    def clear(self):
+        with self.guard:
+            idle, self.idle = self.idle, {}
+
+        for candidates in idle.itervalues():
+            for connection, released in candidates:
+                connection.close()
+
+    def evict(self):
+        now = time.time()
+        threshold = now - self.lifetime
+
+        with self.guard:
+            self.evicted = now
+            for key, candidates in self.idle.items():
+                retained = []
+                for connection, released in candidates:
+                    if released < threshold:
+                        connection.close()
+                    else:
+                        retained.append((connection, released))
+                if retained:
+                    self.idle[key] = retained
+                else:
+                    del self.idle[key]
+
+    def release(self, scheme, host, port, connection):
+        if not connection.sock:
+            return
+
+        now, retained = time.time(), False
+        with self.guard:
+            candidates = self.idle.setdefault((scheme, host, port), [])
+            if len(candidates) < self.maximum:
+                candidates.append((connection, now))
+                retained = True
+
+        if not retained:
+            connection.close()
+        if now - self.evicted > self.lifetime:
+            self.evict()
+
+    def _is_stale(self, connection):
+        if not connection.sock:
+            return True
+
+        try:
+            poller = select.poll()
+            poller.register(connection.sock, select.POLLIN)
+            return bool(poller.poll(0))
+        except (select.error, socket.error, ValueError):
+            return True
+
 class Response(object):
-    def __init__(self, status, reason, mimetype, content, headers):
+    def __init__(self, status, reason, mimetype, content, headers, length=None,
+            truncated=False, digest=None, exhausted=True):
         self.content = content
+        self.digest = digest
+        self.exhausted = exhausted
         self.headers = headers
+        self.length = length
         self.mimetype = mimetype
         self.reason = reason
         self.status = status
+        self.truncated = truncated
 
     @property
     def exception(self):
@@ -21,47 +125,160 @@ class Response(object):
     def ok(self):
         return (200 <= self.status <= 299)
 
+    @classmethod
+    def construct(cls, response, limit=None, overflow='truncate', headers_only=False,
+            partial=False):
+
+        headers = dict((key.title(), value) for key, value in response.getheaders())
+        mimetype = response.getheader('Content-Type', None)
+        if headers_only:
+            return cls(response.status, response.reason, mimetype, None, headers,
+                exhausted=False)
+
+        chunks, length, hasher = [], 0, None
+        truncated, exhausted = False, True
+        while True:
+            try:
+                chunk = response.read(CHUNK_SIZE)
+            except IncompleteRead, exception:
+                if not partial:
+                    raise
+                chunk, truncated = exception.partial, True
+
+            if not chunk:
+                break
+
+            length += len(chunk)
+            if hasher:
+                hasher.update(chunk)
+            elif limit is None or length <= limit:
+                chunks.append(chunk)
+            elif overflow == 'digest':
+                hasher = hashlib.sha256(''.join(chunks))
+                hasher.update(chunk)
+                chunks = []
+            else:
+                chunks.append(chunk[:len(chunk) - (length - limit)])
+                truncated, exhausted = True, False
+                break
+
+            if truncated:
+                break
+
+        content = ''.join(chunks) or None
+        digest = (hasher.hexdigest() if hasher else None)
+
+        return cls(response.status, response.reason, mimetype, content, headers,
+            length, truncated, digest, exhausted)
+
     def dump(self):
         lines = ['%s %s' % (self.status, self.reason)]
         for header, value in sorted(self.headers.iteritems()):
             lines.append('%s: %s' % (header, value))
 
-        if self.content:
+        if self.digest:
+            lines.extend(['', '[%d bytes omitted, sha256 %s]' % (self.length, self.digest)])
+        elif self.content:
             lines.extend(['', self.content])
+            if self.truncated:
+                lines.append('[truncated after %d bytes]' % len(self.content))
         return '\n'.join(lines)
 
     def unserialize(self):
         if self.content:
             return formats.unserialize(self.mimetype, self.content)
 
-def http_request(method, url, body=None, mimetype=None, headers=None,
-        timeout=None, serialize=False):
-
-    scheme, host, path = urlparse(url)[:3]
-    if scheme == 'https':
-        connection = HTTPSConnection(host=host, timeout=timeout)
-    else:
-        connection = HTTPConnection(host=host, timeout=timeout)
-
-    if body:
-        if method == 'GET':
-            path = '%s?%s' % (path, body)
-            body = None
-        elif serialize:
-            if mimetype:
-                body = formats.serialize(mimetype, body)
+class Request(object):
+    def __init__(self, method, url, body=None, mimetype=None, headers=None,
+            timeout=None, serialize=False, limit=None, overflow='truncate',
+            headers_only=False):
+
+        scheme, host, path = urlparse(url)[:3]
+        if body:
+            if method == 'GET':
+                path = '%s?%s' % (path, body)
+                body = None
+            elif serialize:
+                if mimetype:
+                    body = formats.serialize(mimetype, body)
+                else:
+                    raise ValueError(mimetype)
+
+        headers = dict(headers or {})
+        if 'Content-Type' not in headers and mimetype:
+            headers['Content-Type'] = mimetype
+
+        self.body = body
+        self.headers = headers
+        self.headers_only = headers_only
+        self.host = host
+        self.limit = limit
+        self.method = method
+        self.overflow = overflow
+        self.path = path
+        self.scheme = scheme
+        self.timeout = timeout
+        self.url = url
+
+    @property
+    def address(self):
+        host, port = self.host, None
+        if ':' in host.rsplit(']', 1)[-1]:
+            host, port = host.rsplit(':', 1)
+            port = int(port)
+        host = host.strip('[]')
+        if not port:
+            port = (443 if self.scheme == 'https' else 80)
+        return host, port
+
+    def send(self, pool=None):
+        pool = pool or connections
+        host, port = self.address
+
+        connection, reused = pool.acquire(self.scheme, host, port, self.timeout)
+        while True:
+            try:
+                response, will_close = self._send(connection)
+            except Exception, exception:
+                connection.close()
+                if not (reused and self.method in IDEMPOTENT_METHODS
+                        and self._is_stale_failure(exception)):
+                    raise
+
+                metrics.counter('platoon_http_pool_retries',
+                    'Number of http requests retried after hitting a stale connection.').inc()
+                connection, reused = pool.connect(self.scheme, host, port, self.timeout), False
             else:
-                raise ValueError(mimetype)
+                break
 
-    headers = headers or {}
-    if 'Content-Type' not in headers and mimetype:
-        headers['Content-Type'] = mimetype
+        if will_close:
+            connection.close()
+        else:
+            pool.release(self.scheme, host, port, connection)
+        return response
 
-    connection.request(method, path, body, headers)
-    response = connection.getresponse()
+    def _is_stale_failure(self, exception):
+        if isinstance(exception, socket.timeout):
+            return False
+        return isinstance(exception, (HTTPException, socket.error))
 
-    headers = dict((key.title(), value) for key, value in response.getheaders())
-    content = response.read() or None
+    def construct_response(self, response, partial=False):
+        overflow = ('truncate' if partial else self.overflow)
+        return Response.construct(response, self.limit, overflow,
+            self.headers_only, partial)
+
+    def _send(self, connection):
+        connection.request(self.method, self.path, self.body, self.headers)
+        response = connection.getresponse()
+
+        constructed = self.construct_response(response)
+        return constructed, (response.will_close or not constructed.exhausted)
+
+connections = ConnectionPool()
+
+def http_request(method, url, body=None, mimetype=None, headers=None,
+        timeout=None, serialize=False, limit=None, overflow='truncate', headers_only=False):
 
-    mimetype = response.getheader('Content-Type', None)
-    return Response(response.status, response.reason, mimetype, content, headers)
+    request = Request(method, url, body, mimetype, headers, timeout, serialize,
+        limit, overflow, headers_only)
+    return request.send()
@@ -0,0 +1,220 @@
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from bisect import bisect_left
+from SocketServer import ThreadingMixIn
+
+__all__ = ('Counter', 'Gauge', 'Histogram', 'MetricsServer', 'Registry', 'registry')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Metric(object):
+    """A metric, optionally partitioned by labels."""
+
+    type = None
+
+    def __init__(self, name, description=None):
+        self.description = description
+        self.guard = threading.Lock()
+        self.name = name
+        self.values = {}
+
+    def collect(self):
+        with self.guard:
+            return sorted(self.values.iteritems())
+
+    def get(self, **labels):
+        return self.values.get(self._identify(labels), 0)
+
+    def remove(self, **labels):
+        key = self._identify(labels)
+        with self.guard:
+            self.values.pop(key, None)
+
+    def render(self):
+        lines = []
+        if self.description:
+            lines.append('# HELP %s %s' % (self.name, _escape(self.description, False)))
+        lines.append('# TYPE %s %s' % (self.name, self.type))
+
+        for labels, value in self.collect():
+            lines.append('%s%s %s' % (self.name, _format_labels(labels), _format_value(value)))
+        return lines
+
+    def _identify(self, labels):
+        return tuple(sorted(labels.iteritems()))
+
+class Counter(Metric):
+    """A monotonically increasing metric."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._identify(labels)
+        with self.guard:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """A metric which can arbitrarily go up and down."""
+
+    type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._identify(labels)
+        with self.guard:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        key = self._identify(labels)
+        with self.guard:
+            self.values[key] = value
+
+class Histogram(Metric):
+    """A metric which counts observations into fixed buckets."""
+
+    type = 'histogram'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, name, description=None, buckets=None):
+        super(Histogram, self).__init__(name, description)
+        self.buckets = tuple(sorted(buckets or self.BUCKETS))
+
+    def collect(self):
+        with self.guard:
+            return sorted((key, (list(counts), total, count))
+                for key, (counts, total, count) in self.values.iteritems())
+
+    def get(self, **labels):
+        values = self.values.get(self._identify(labels))
+        return (values[2] if values else 0)
+
+    def observe(self, value, **labels):
+        key = self._identify(labels)
+        index = bisect_left(self.buckets, value)
+
+        with self.guard:
+            values = self.values.get(key)
+            if values is None:
+                values = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                values[0][index] += 1
+            values[1] += value
+            values[2] += 1
+
+    def render(self):
+        lines = []
+        if self.description:
+            lines.append('# HELP %s %s' % (self.name, _escape(self.description, False)))
+        lines.append('# TYPE %s %s' % (self.name, self.type))
+
+        for labels, (counts, total, count) in self.collect():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append('%s_bucket%s %d' % (self.name,
+                    _format_labels(labels + (('le', _format_value(bound)),)), cumulative))
+
+            lines.append('%s_bucket%s %d' % (self.name,
+                _format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('%s_sum%s %s' % (self.name, _format_labels(labels),
+                _format_value(total)))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(labels), count))
+        return lines
+
+class Registry(object):
+    """A registry of metrics."""
+
+    def __init__(self):
+        self.guard = threading.Lock()
+        self.metrics = {}
+
+    def __iter__(self):
+        with self.guard:
+            metrics = sorted(self.metrics.iteritems())
+        return iter([metric for name, metric in metrics])
+
+    def counter(self, name, description=None):
+        return self._acquire(Counter, name, description)
+
+    def gauge(self, name, description=None):
+        return self._acquire(Gauge, name, description)
+
+    def histogram(self, name, description=None, buckets=None):
+        return self._acquire(Histogram, name, description, buckets=buckets)
+
+    def remove(self, name, **labels):
+        with self.guard:
+            metric = self.metrics.get(name)
+        if metric is not None:
+            metric.remove(**labels)
+
+    def render(self):
+        lines = []
+        for metric in self:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _acquire(self, implementation, name, description, **params):
+        with self.guard:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = implementation(name, description, **params)
+            elif not isinstance(metric, implementation):
+                raise ValueError(name)
+            return metric
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            return self.send_error(404)
+
+        content = self.server.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """An http server exposing a registry in the prometheus text format."""
+
+    daemon_threads = True
+
+    def __init__(self, address, port, registry):
+        HTTPServer.__init__(self, (address, port), MetricsHandler)
+        self.registry = registry
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='platoon-metrics')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def _escape(value, quotes=True):
+    value = unicode(value).replace('\\', '\\\\').replace('\n', '\\n')
+    if quotes:
+        value = value.replace('"', '\\"')
+    return value.encode('utf8')
+
+def _format_labels(labels):
+    if labels:
+        return '{%s}' % ','.join('%s="%s"' % (key, _escape(value)) for key, value in labels)
+    return ''
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+registry = Registry()
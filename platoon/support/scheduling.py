@@ -1,5 +1,11 @@
+import threading
+from bisect import bisect_left
+from calendar import monthrange
+from collections import OrderedDict
 from scheme.timezone import current_timestamp, UTC
-from datetime import datetime, timedelta, time
+from datetime import MAXYEAR, date, datetime, timedelta, time
+
+from platoon.support.metrics import registry as metrics
 
 QUANTITIES = {
     'minute': (0, 59),
@@ -9,21 +15,23 @@ QUANTITIES = {
     'month': (1, 12),
 }
 
+LAYOUT_LIMIT = 4800
 STEPS = ['', 'first', 'second', 'third', 'fourth', 'fifth']
 
+layouts = {}
+
 def advance_by_month(value, interval):
-    for _ in range(interval):
-        if value.month == 12:
-            value = value.replace(value.year + 1, 1, value.day)
-        else:
-            value = value.replace(value.year, value.month + 1, value.day)
-    else:
-        return value
+    months = value.year * 12 + value.month - 1 + interval
+    return value.replace(months // 12, months % 12 + 1, value.day)
 
 def advance_by_week(value, interval):
-    for _ in range(interval):
-        value += timedelta(days=7)
-    return value
+    return value + timedelta(days=7 * interval)
+
+def compose_mask(values):
+    mask = 0
+    for value in values:
+        mask |= 1 << value
+    return mask
 
 def construct_weekday_step(occurrence):
     return '%s/%s' % (occurrence.isoweekday(), identify_weekday_step(occurrence))
@@ -32,21 +40,21 @@ def describe_weekday_step(occurrence):
     step = STEPS[identify_weekday_step(occurrence)]
     return '%s %s' % (step, occurrence.strftime('%A'))
 
+def identify_month_layout(year, month):
+    try:
+        return layouts[year, month]
+    except KeyError:
+        pass
+
+    if len(layouts) >= LAYOUT_LIMIT:
+        layouts.clear()
+
+    first, length = monthrange(year, month)
+    layout = layouts[year, month] = (first + 1, length)
+    return layout
+
 def identify_weekday_step(value):
-    if isinstance(value, datetime):
-        value = value.date()
-
-    weekday = value.isoweekday()
-    step = 0
-
-    day = value.replace(day=1)
-    while True:
-        if day.isoweekday() == weekday:
-            step += 1
-        if day.day == value.day:
-            return step
-        else:
-            day += timedelta(days=1)
+    return (value.day - 1) // 7 + 1
 
 def validate_range(quantity, value):
     try:
@@ -120,6 +128,17 @@ class Specification(object):
         self.hour = validate_range('hour', hour or '*')
         self.minute = validate_range('minute', minute or '*')
 
+        self.month_mask = compose_mask(self.month)
+        self.day_mask = compose_mask(self.day)
+        self.hour_mask = compose_mask(self.hour)
+        self.minute_mask = compose_mask(self.minute)
+
+        self.weekday_masks = None
+        if self.weekday:
+            self.weekday_masks = [0] * 8
+            for weekday, steps in self.weekday.iteritems():
+                self.weekday_masks[weekday] = compose_mask(steps)
+
     def generate(self, count, occurrence=None):
         for i in range(count):
             occurrence = self.next(occurrence)
@@ -130,26 +149,55 @@ class Specification(object):
             occurrence = current_timestamp()
 
         occurrence = occurrence.replace(second=0, microsecond=0)
-        if self._check_date(occurrence):
-            candidate = self._next_time(occurrence)
-            if candidate:
-                return candidate
-
-        occurrence = occurrence.replace(hour=0, minute=0)
+        candidate = self._next_date(occurrence.date())
+        if candidate == occurrence.date():
+            value = self._next_time(occurrence)
+            if value:
+                return value
+            candidate = self._next_date(candidate + timedelta(days=1))
+
+        return occurrence.replace(year=candidate.year, month=candidate.month,
+            day=candidate.day, hour=self.hour[0], minute=self.minute[0])
+
+    def occurrences(self, start, end=None, limit=None):
+        start = start.replace(second=0, microsecond=0)
+        times = [(hour, minute) for hour in self.hour for minute in self.minute]
+
+        first, occurrences = start.date(), []
+        current = self._next_date(first)
         while True:
-            occurrence += timedelta(days=1)
-            if self._check_date(occurrence):
-                candidate = self._next_time(occurrence)
-                if candidate:
-                    return candidate
-
-    def next_monthly_interval(self, interval, occurrence=None):
-        now = current_timestamp()
+            days = self._matching_days(current.year, current.month)
+            for day in days[bisect_left(days, current.day):]:
+                offset = 0
+                if current.replace(day=day) == first:
+                    offset = bisect_left(times, (start.hour, start.minute))
+
+                for hour, minute in times[offset:]:
+                    occurrence = start.replace(year=current.year, month=current.month,
+                        day=day, hour=hour, minute=minute)
+                    if end and occurrence > end:
+                        return occurrences
+
+                    occurrences.append(occurrence)
+                    if limit and len(occurrences) >= limit:
+                        return occurrences
+
+            current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+            if end and current > end.date() + timedelta(days=1):
+                return occurrences
+            current = self._next_date(current)
+
+    def next_monthly_interval(self, interval, occurrence=None, now=None):
+        now = now or current_timestamp()
         if not occurrence:
             occurrence = now
 
         candidate = occurrence.replace(day=1, hour=0, minute=1)
         current_month_threshold = now.replace(day=1, hour=0, minute=0)
+
+        periods = ((now.year - candidate.year) * 12 + now.month - candidate.month) // interval
+        if periods > 2:
+            candidate = advance_by_month(candidate, (periods - 2) * interval)
         while candidate < current_month_threshold:
             candidate = advance_by_month(candidate, interval)
 
@@ -158,13 +206,13 @@ class Specification(object):
             next = self.next(advance_by_month(candidate, interval))
         return next
 
-    def next_weekly_interval(self, interval, occurrence=None):
-        now = current_timestamp()
+    def next_weekly_interval(self, interval, occurrence=None, now=None):
+        now = now or current_timestamp()
         if not occurrence:
             occurrence = now
 
         if occurrence > now and self._check_date(occurrence):
-            if occurrence.hour in self.hour and occurrence.minute in self.minute:
+            if self.hour_mask >> occurrence.hour & 1 and self.minute_mask >> occurrence.minute & 1:
                 return occurrence
 
         week = Week.from_date(occurrence)
@@ -174,7 +222,11 @@ class Specification(object):
 
         candidate = datetime.combine(week.start, time(0, 0, 0)).replace(
                 tzinfo=occurrence.tzinfo)
-        while now > candidate:
+
+        periods = (now - candidate).days // (7 * interval)
+        if periods > 2:
+            candidate = advance_by_week(candidate, (periods - 2) * interval)
+        while now >= candidate:
             candidate = advance_by_week(candidate, interval)
             week = Week.from_date(candidate)
             if now in week:
@@ -184,32 +236,105 @@ class Specification(object):
         return self.next(candidate)
 
     def _check_date(self, value):
-        if value.month not in self.month:
+        if not self.month_mask >> value.month & 1:
             return False
-        if value.day not in self.day:
+        if not self.day_mask >> value.day & 1:
             return False
-        if not self.weekday:
+        if not self.weekday_masks:
             return True
 
-        weekday = value.isoweekday()
-        if weekday not in self.weekday:
+        steps = self.weekday_masks[value.isoweekday()]
+        if not steps:
             return False
+        return bool(steps >> identify_weekday_step(value) & 1)
 
-        step = identify_weekday_step(value)
-        return step in self.weekday[weekday]
+    def _matching_days(self, year, month):
+        if not self.month_mask >> month & 1:
+            return []
 
-    def _next_time(self, value):
-        candidate = value.replace(second=0, microsecond=0)
-        while candidate.date() == value.date():
-            if candidate.hour not in self.hour:
-                if candidate.hour < 23:
-                    candidate = candidate.replace(hour=candidate.hour + 1, minute=0)
-                else:
-                    return
-            elif candidate.minute not in self.minute:
-                candidate += timedelta(minutes=1)
+        first, length = identify_month_layout(year, month)
+        masks, days = self.weekday_masks, []
+        for day in self.day:
+            if day > length:
+                break
+            if masks and not masks[(first + day - 2) % 7 + 1] >> ((day - 1) // 7 + 1) & 1:
+                continue
+            days.append(day)
+        return days
+
+    def _next_date(self, value):
+        year, month, day = value.year, value.month, value.day
+        while year <= MAXYEAR:
+            index = bisect_left(self.month, month)
+            if index == len(self.month):
+                year, month, day = year + 1, self.month[0], 1
+                continue
+            elif self.month[index] != month:
+                month, day = self.month[index], 1
+
+            days = self._matching_days(year, month)
+            index = bisect_left(days, day)
+            if index < len(days):
+                return date(year, month, days[index])
+
+            if month == 12:
+                year, month, day = year + 1, 1, 1
             else:
-                return candidate
+                month, day = month + 1, 1
+
+        raise OverflowError('no matching date before year %d' % MAXYEAR)
+
+    def _next_time(self, value):
+        index = bisect_left(self.hour, value.hour)
+        if index < len(self.hour) and self.hour[index] == value.hour:
+            position = bisect_left(self.minute, value.minute)
+            if position < len(self.minute):
+                return value.replace(minute=self.minute[position], second=0, microsecond=0)
+            index += 1
+
+        if index < len(self.hour):
+            return value.replace(hour=self.hour[index], minute=self.minute[0],
+                second=0, microsecond=0)
+
+class SpecificationCache(object):
+    """A thread-safe, bounded LRU cache of compiled specifications, keyed by the
+    id of the schedule they were compiled for."""
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.guard = threading.Lock()
+
+    def acquire(self, key, specification):
+        specification = tuple(specification)
+        if key is None:
+            return Specification(specification)
+
+        with self.guard:
+            entry = self.entries.pop(key, None)
+            if entry and entry[0] == specification:
+                self.entries[key] = entry
+                metrics.counter('platoon_specification_cache_hits',
+                    'Number of schedule computations which reused a compiled specification.').inc()
+                return entry[1]
+
+        metrics.counter('platoon_specification_cache_misses',
+            'Number of schedule computations which compiled a specification.').inc()
+
+        compiled = Specification(specification)
+        with self.guard:
+            self.entries[key] = (specification, compiled)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self.guard:
+            self.entries.clear()
+
+    def invalidate(self, key):
+        with self.guard:
+            self.entries.pop(key, None)
 
 class Week(object):
     def __init__(self, start, end):
@@ -226,12 +351,7 @@ class Week(object):
         if isinstance(value, datetime):
             value = value.date()
 
-        start = value
-        while start.isoweekday() != 7:
-            start -= timedelta(days=1)
-
-        end = value
-        while end.isoweekday() != 6:
-            end += timedelta(days=1)
+        start = value - timedelta(days=value.isoweekday() % 7)
+        return cls(start, start + timedelta(days=6))
 
-        return cls(start, end)
+specifications = SpecificationCache()
@@ -0,0 +1,87 @@
+import threading
+
+__all__ = ('SubscriptionIndex',)
+
+class SubscriptionIndex(object):
+    """An in-memory index of event subscriptions.
+
+    Subscriptions are grouped by topic. Within a topic, subscriptions without
+    aspects match every event, while the rest are found through an inverted
+    index over their aspect key/value pairs: a subscription matches an event
+    when every one of its pairs is among the aspects of the event, mirroring
+    hstore containment.
+    """
+
+    def __init__(self):
+        self.guard = threading.Lock()
+        self.subscriptions = {}
+        self.topics = {}
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def add(self, identifier, topic, aspects=None):
+        with self.guard:
+            self._discard(identifier)
+            self._add(identifier, topic, aspects)
+
+    def discard(self, identifier):
+        with self.guard:
+            self._discard(identifier)
+
+    def match(self, topic, aspects=None):
+        with self.guard:
+            entry = self.topics.get(topic)
+            if not entry:
+                return set()
+
+            unconditional, inverted = entry
+            matches = set(unconditional)
+            if not (aspects and inverted):
+                return matches
+
+            hits = {}
+            for pair in aspects.iteritems():
+                for identifier in inverted.get(pair, ()):
+                    hits[identifier] = hits.get(identifier, 0) + 1
+
+            subscriptions = self.subscriptions
+            for identifier, count in hits.iteritems():
+                if count == len(subscriptions[identifier][1]):
+                    matches.add(identifier)
+            return matches
+
+    def replace(self, subscriptions):
+        with self.guard:
+            self.subscriptions, self.topics = {}, {}
+            for identifier, topic, aspects in subscriptions:
+                self._add(identifier, topic, aspects)
+
+    def _add(self, identifier, topic, aspects):
+        pairs = frozenset((aspects or {}).iteritems())
+        self.subscriptions[identifier] = (topic, pairs)
+
+        unconditional, inverted = self.topics.setdefault(topic, (set(), {}))
+        if not pairs:
+            unconditional.add(identifier)
+        for pair in pairs:
+            inverted.setdefault(pair, set()).add(identifier)
+
+    def _discard(self, identifier):
+        entry = self.subscriptions.pop(identifier, None)
+        if not entry:
+            return
+
+        topic, pairs = entry
+        unconditional, inverted = self.topics[topic]
+        if not pairs:
+            unconditional.discard(identifier)
+
+        for pair in pairs:
+            identifiers = inverted[pair]
+            identifiers.discard(identifier)
+            if not identifiers:
+                del inverted[pair]
+
+        if not (unconditional or inverted):
+            del self.topics[topic]
@@ -0,0 +1,53 @@
+import heapq
+import threading
+
+__all__ = ('TimerHeap',)
+
+class TimerHeap(object):
+    """A thread-safe heap of timers, keyed by identifier."""
+
+    def __init__(self):
+        self.entries = {}
+        self.guard = threading.Lock()
+        self.heap = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, identifier, due):
+        with self.guard:
+            if self.entries.get(identifier) == due:
+                return False
+
+            self.entries[identifier] = due
+            heapq.heappush(self.heap, (due, identifier))
+            return self._prune() == due
+
+    def clear(self):
+        with self.guard:
+            self.entries, self.heap = {}, []
+
+    def discard(self, identifier):
+        with self.guard:
+            self.entries.pop(identifier, None)
+
+    def expire(self, now):
+        expired = []
+        with self.guard:
+            while self._prune() is not None and self.heap[0][0] <= now:
+                due, identifier = heapq.heappop(self.heap)
+                del self.entries[identifier]
+                expired.append(identifier)
+        return expired
+
+    def next(self):
+        with self.guard:
+            return self._prune()
+
+    def _prune(self):
+        heap, entries = self.heap, self.entries
+        while heap:
+            due, identifier = heap[0]
+            if entries.get(identifier) == due:
+                return due
+            heapq.heappop(heap)